@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["sklearn", "scipy", "matplotlib", "seaborn"]
+
+# name: the code a freshly started worker runs. {preprocessor} is replaced by the path of a saved Preprocessor.
+SCENARIOS = {
+    "import_utils": "import utils",
+    "import_processing": "import utils.processing",
+    "import_streaming": "import utils.streaming",
+    "import_serving": "import utils.serving",
+    "preprocess_worker": (
+        "import pandas as pd\n"
+        "from utils.processing import Preprocessor\n"
+        "preprocessor = Preprocessor.load({preprocessor!r})\n"
+        "preprocessor.transform(pd.read_csv({batch!r}), clean=True)"
+    ),
+    "import_visualization": "import utils.visualization",
+}
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+exec(compile({code!r}, "<scenario>", "exec"))
+seconds = time.perf_counter() - start
+print(repr((seconds, [name for name in {heavy!r} if name in sys.modules])))
+"""
+
+
+def measure(code: str, repeat: int = 5) -> dict:
+    """
+    Times a scenario in fresh interpreters, so nothing is already imported, and records which heavy dependencies it
+    pulled in.
+    :param code: The code the scenario runs.
+    :param repeat: The number of interpreters started. Defaults to 5.
+    :return: The measurements, as a dict.
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(code=code, heavy=HEAVY_MODULES)], cwd=ROOT,
+                                env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True, check=True)
+        seconds, loaded = eval(output.stdout.strip().splitlines()[-1])
+        times.append(seconds)
+    return {"seconds": float(np.median(times)), "min_seconds": min(times), "loaded": loaded}
+
+
+def run_benchmarks(scenarios: list[str], repeat: int = 5) -> dict:
+    """
+    Runs every scenario. The preprocess_worker scenario loads a Preprocessor fitted on a small synthetic table and
+    transforms a 1,000 row batch, as a batch worker does on start.
+    :param scenarios: The names of the scenarios to benchmark.
+    :param repeat: The number of interpreters started per scenario. Defaults to 5.
+    :return: The report, as a JSON serializable dict.
+    """
+    from benchmarks.synthetic import synthetic_patients
+    from utils.processing import Preprocessor
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {"preprocessor": os.path.join(directory, "preprocessor.joblib"),
+                 "batch": os.path.join(directory, "batch.csv")}
+        Preprocessor().fit(synthetic_patients(10 ** 4)).save(paths["preprocessor"])
+        synthetic_patients(10 ** 3, random_state=1).drop(columns=["Sepssis"]).to_csv(paths["batch"], index=False)
+        for scenario in scenarios:
+            result = measure(SCENARIOS[scenario].format(**paths), repeat)
+            results.append({"scenario": scenario, **result})
+            print(f"{scenario:25}{result['seconds']:>10.3f}s   {', '.join(result['loaded']) or '-'}")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the start-up time of workers using the utils package.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Save the results to this JSON file.")
+    args = parser.parse_args()
+
+    print(f"{'Scenario':25}{'Time':>11}   Heavy modules loaded\n{'-' * 72}")
+    report = run_benchmarks(args.scenarios, args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
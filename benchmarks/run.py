@@ -0,0 +1,208 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.impute import KNNImputer
+
+from benchmarks.synthetic import synthetic_patients
+from utils.processing import FEATURE_COLS, DataCSV, Preprocessor, cap_outliers_iqr, impute_outliers_iqr, \
+    treat_outliers_iqr
+from utils.quality import profile_quality
+from utils.visualization import count_outliers_iqr, count_zero_vals
+
+
+def _features(workload: dict) -> pd.DataFrame:
+    return workload["cleaned"][FEATURE_COLS].copy()
+
+
+def _per_column(fn) -> callable:
+    def run(df: pd.DataFrame) -> None:
+        for col in FEATURE_COLS:
+            fn(col, df)
+    return run
+
+
+# name: (setup, run, max_rows). setup builds the stage input from the workload and is not timed.
+STAGES = {
+    "data_csv": (lambda w: w, lambda w: DataCSV(w["train_path"], w["test_path"]), None),
+    "preprocessor_fit": (lambda w: w["raw"], lambda df: Preprocessor().fit(df), None),
+    "preprocessor_transform": (lambda w: (Preprocessor().fit(w["raw"]), w["raw"]), lambda a: a[0].transform(a[1]), None),
+    "impute_outliers_iqr": (_features, _per_column(lambda col, df: impute_outliers_iqr(col, df, KNNImputer())),
+                            2 * 10 ** 4),  # O(n²) memory
+    "cap_outliers_iqr": (_features, _per_column(cap_outliers_iqr), None),
+    "treat_outliers_iqr": (lambda w: np.asfortranarray(w["cleaned"][FEATURE_COLS].to_numpy(dtype=np.float64)),
+                           treat_outliers_iqr, None),
+    "count_outliers_iqr": (_features, _per_column(count_outliers_iqr), None),
+    "count_zero_vals": (lambda w: w["raw"], lambda df: count_zero_vals(df, FEATURE_COLS), None),
+    "profile_quality": (lambda w: w["raw"], profile_quality, None),
+}
+
+
+def make_workload(n_rows: int, directory: str, random_state: int = 0) -> dict:
+    """
+    Generates the synthetic inputs every stage draws from: a raw table (also written as train and test CSV files)
+    and a cleaned table.
+    :param n_rows: The number of rows of each table.
+    :param directory: The directory to write the CSV files to.
+    :param random_state: Seed for reproducible tables. Defaults to 0.
+    :return: The workload, as a dict.
+    """
+    raw = synthetic_patients(n_rows, raw=True, random_state=random_state)
+    workload = {
+        "raw": raw,
+        "cleaned": synthetic_patients(n_rows, raw=False, random_state=random_state),
+        "train_path": os.path.join(directory, f"train_{n_rows}.csv"),
+        "test_path": os.path.join(directory, f"test_{n_rows}.csv"),
+    }
+    raw.to_csv(workload["train_path"], index=False)
+    raw.drop(columns=["Sepssis"]).to_csv(workload["test_path"], index=False)
+    return workload
+
+
+def measure(stage: str, workload: dict, repeat: int = 3) -> dict:
+    """
+    Times a stage, and measures its peak RSS growth and its peak traced allocations. The RSS growth is the high-water
+    mark of the resident memory during the last run (after any lazy imports), minus the resident memory just before
+    it, so neither the workload nor the memory a forked process shares with its parent is counted. It is None where
+    the high-water mark cannot be reset (outside Linux).
+    :param stage: The name of the stage, a key of STAGES.
+    :param workload: The workload from make_workload.
+    :param repeat: The number of timed runs. Defaults to 3.
+    :return: The measurements, as a dict.
+    """
+    setup, run, _ = STAGES[stage]
+    times = []
+    rss_growth = None
+    for i in range(repeat):
+        args = setup(workload)
+        rss_before = _reset_peak_rss() if i == repeat - 1 else None
+        start = time.perf_counter()
+        run(args)
+        times.append(time.perf_counter() - start)
+        if rss_before is not None:
+            rss_growth = _status_bytes("VmHWM") - rss_before
+
+    args = setup(workload)
+    tracemalloc.start()
+    run(args)
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": min(times),
+        "mean_seconds": float(np.mean(times)),
+        "rss_growth_bytes": rss_growth,
+        "alloc_peak_bytes": alloc_peak,
+    }
+
+
+def _reset_peak_rss() -> int | None:
+    # Resets the high-water mark of the resident memory (VmHWM) to the current RSS, which is returned
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return _status_bytes("VmRSS")
+    except OSError:
+        return None
+
+
+def _status_bytes(field: str) -> int:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} is not in /proc/self/status")
+
+
+_workload = None  # Inherited by the forked measuring processes, so it is never pickled
+
+
+def _measure_forked(stage: str, repeat: int) -> dict:
+    return measure(stage, _workload, repeat)
+
+
+def run_benchmarks(sizes: list[int], stages: list[str], repeat: int = 3) -> dict:
+    """
+    Runs every stage at every size, each in a forked process.
+    :param sizes: The numbers of rows to benchmark.
+    :param stages: The names of the stages to benchmark.
+    :param repeat: The number of timed runs per stage. Defaults to 3.
+    :return: The report, as a JSON serializable dict.
+    """
+    global _workload
+    context = multiprocessing.get_context("fork")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in sizes:
+            _workload = make_workload(n_rows, directory)
+            for stage in stages:
+                max_rows = STAGES[stage][2]
+                if max_rows is not None and n_rows > max_rows:
+                    continue
+                with context.Pool(1) as pool:
+                    result = pool.apply(_measure_forked, (stage, repeat))
+                results.append({"stage": stage, "n_rows": n_rows, **result})
+                rss_growth = result["rss_growth_bytes"]
+                rss_growth = f"{rss_growth / 2 ** 20:>10.1f}MB" if rss_growth is not None else f"{'n/a':>12}"
+                print(f"{stage:25}{n_rows:>10}{result['seconds']:>12.4f}s{rss_growth}"
+                      f"{result['alloc_peak_bytes'] / 2 ** 20:>10.1f}MB")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compares a report against a baseline report.
+    :param report: The new report.
+    :param baseline: The baseline report.
+    :param threshold: The relative slowdown allowed, e.g. 0.25 for 25%.
+    :return: A description of every (stage, size) that slowed down beyond the threshold.
+    """
+    baseline_seconds = {(result["stage"], result["n_rows"]): result["seconds"] for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        reference = baseline_seconds.get((result["stage"], result["n_rows"]))
+        if reference is not None and result["seconds"] > reference * (1 + threshold):
+            regressions.append(f"{result['stage']} at {result['n_rows']} rows: {result['seconds']:.4f}s "
+                               f"vs {reference:.4f}s baseline ({result['seconds'] / reference - 1:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing and evaluation hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5],
+                        help="Numbers of rows to benchmark (10^3 to 10^7).")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Save the results to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="Compare the results against this JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown that fails the comparison.")
+    args = parser.parse_args()
+
+    print(f"{'Stage':25}{'Rows':>10}{'Time':>13}{'RSS growth':>12}{'Alloc':>12}\n{'-' * 72}")
+    report = run_benchmarks(args.sizes, args.stages, args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
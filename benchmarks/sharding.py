@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import DATA_DIR, synthetic_patients
+from utils.processing import FEATURE_COLS, TARGET_COL, Preprocessor
+from utils.sharding import process_csv_sharded, shard_out_paths
+
+# Allowed deviations from the single-process result. While the sketches are exact, only the float32 rounding of the
+# streaming source dtypes remains; beyond that, the IQR bounds (and what depends on them) are within the sketch error.
+EXACT_TOLERANCE = 1e-4
+SKETCH_TOLERANCE = {"bounds": 0.02, "scaler": 0.01, "features_p99": 0.05}
+
+
+def write_shards(raw: pd.DataFrame, n_shards: int, directory: str, random_state: int = 0) -> list[str]:
+    """
+    Splits a raw table into site shards that all share the same file name (site0/train.csv, site1/train.csv, ...),
+    with rows duplicated within a shard and rows repeated from earlier shards.
+    :param raw: The raw table, with the Paitients_Files schema.
+    :param n_shards: The number of shards (at least 2).
+    :param directory: The directory to write the site directories to.
+    :param random_state: Seed for the duplicated rows. Defaults to 0.
+    :return: The path of each shard.
+    """
+    rng = np.random.default_rng(random_state)
+    parts = np.array_split(raw, n_shards)
+    n_duplicates = max(1, len(raw) // 100)
+    parts[1] = pd.concat([parts[1], parts[1].sample(n_duplicates, random_state=random_state)])
+    for i in range(1, n_shards):
+        earlier = parts[rng.integers(i)]
+        parts[i] = pd.concat([parts[i], earlier.sample(n_duplicates, random_state=random_state + i)])
+    paths = []
+    for i, part in enumerate(parts):
+        paths.append(os.path.join(directory, f"site{i}", "train.csv"))
+        os.makedirs(os.path.dirname(paths[-1]), exist_ok=True)
+        part.to_csv(paths[-1], index=False)
+    return paths
+
+
+def check(raw: pd.DataFrame, n_shards: int, directory: str, n_jobs: int = 2, sketch_size: int = 4096) -> dict:
+    """
+    Runs process_csv_sharded on shards of a raw table and compares the result with Preprocessor.fit_transform on the
+    concatenated shards.
+    :param raw: The raw table, with the Paitients_Files schema.
+    :param n_shards: The number of shards (at least 2).
+    :param directory: The directory to write the shards and outputs to.
+    :param n_jobs: The number of worker processes. Defaults to 2.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :return: The deviations, and whether they are within tolerance, as a dict.
+    """
+    paths = write_shards(raw, n_shards, os.path.join(directory, "in"))
+    out_paths = shard_out_paths(paths, os.path.join(directory, "out"))
+    for path in out_paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    sharded = process_csv_sharded(paths, [], out_paths, [], n_jobs, sketch_size=sketch_size)
+    got = pd.concat([pd.read_csv(path) for path in out_paths], ignore_index=True)
+
+    reference = Preprocessor()
+    expected = reference.fit_transform(pd.concat([pd.read_csv(path) for path in paths], ignore_index=True))
+    same_rows = len(got) == len(expected) and (got[TARGET_COL].to_numpy() == expected[TARGET_COL].to_numpy()).all()
+    iqr = reference.impute_bounds_[1] - reference.impute_bounds_[0]
+    result = {
+        "rows": len(got),
+        "expected_rows": len(expected),
+        "bounds": float(np.max(np.abs(np.concatenate([sharded.impute_bounds_ - reference.impute_bounds_,
+                                                      sharded.cap_bounds_ - reference.cap_bounds_]) / iqr))),
+        "scaler": float(max(np.abs(sharded.scaler_.scale_ / reference.scaler_.scale_ - 1).max(),
+                            np.abs(sharded.scaler_.mean_ - reference.scaler_.mean_).max())),
+    }
+    if same_rows:
+        errors = np.abs(got[FEATURE_COLS].to_numpy() - expected[FEATURE_COLS].to_numpy())
+        result["features_max"] = float(errors.max())
+        result["features_p99"] = float(np.quantile(errors, 0.99))
+
+    exact = len(expected) <= sketch_size
+    if not same_rows:
+        result["ok"] = False
+    elif exact:
+        result["ok"] = max(result["bounds"], result["scaler"], result["features_max"]) <= EXACT_TOLERANCE
+    else:
+        result["ok"] = all(result[name] <= tolerance for name, tolerance in SKETCH_TOLERANCE.items())
+    result["exact"] = exact
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that sharded preprocessing matches the single-process result.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10 ** 5],
+                        help="Numbers of synthetic rows to check, besides the bundled training data.")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--n-jobs", type=int, default=2)
+    args = parser.parse_args()
+
+    tables = {"bundled": pd.read_csv(os.path.join(DATA_DIR, "Paitients_Files_Train.csv"))}
+    tables.update({str(n_rows): synthetic_patients(n_rows) for n_rows in args.sizes})
+    print(f"{'Data':10}{'Rows':>10}{'Bounds':>10}{'Scaler':>10}{'Features':>10}   Result\n{'-' * 60}")
+    failed = False
+    for name, raw in tables.items():
+        with tempfile.TemporaryDirectory() as directory:
+            result = check(raw, args.shards, directory, args.n_jobs)
+        failed |= not result["ok"]
+        features = result.get("features_max" if result["exact"] else "features_p99", np.nan)
+        print(f"{name:10}{result['rows']:>10}{result['bounds']:>10.2e}{result['scaler']:>10.2e}{features:>10.2e}   "
+              f"{'ok' if result['ok'] else 'FAILED'}{' (exact)' if result['exact'] else ''}")
+    sys.exit(1 if failed else 0)
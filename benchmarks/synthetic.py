@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.processing import FEATURE_COLS, ZERO_INVALID_COLS, TARGET_COL
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+INT_COLS = ['PRG', 'PL', 'PR', 'SK', 'TS', 'Age']
+
+
+def synthetic_patients(n_rows: int, raw: bool = True, random_state: int = 0,
+                       cleaned_path: str = os.path.join(DATA_DIR, "cleaned_train.csv"),
+                       source_path: str = os.path.join(DATA_DIR, "Paitients_Files_Train.csv")) -> pd.DataFrame:
+    """
+    Generates a synthetic patient table of any size. Each feature is drawn independently, per class, from its values in
+    cleaned_train.csv, so the class balance and the per-class marginal distributions match the real data (the
+    correlations between features do not).
+    :param n_rows: The number of rows to generate.
+    :param raw: Output the Paitients_Files schema (ID, Insurance and a Negative/Positive Sepssis column), with the
+    zero-replacement means turned back into zeros, so the table can be fed to DataCSV. Otherwise, output the
+    cleaned_train.csv schema. Defaults to True.
+    :param random_state: Seed for reproducible tables. Defaults to 0.
+    :param cleaned_path: The path to cleaned_train.csv.
+    :param source_path: The path to Paitients_Files_Train.csv, used to find the zero-replacement means.
+    :return: The synthetic DataFrame.
+    """
+    rng = np.random.default_rng(random_state)
+    cleaned = pd.read_csv(cleaned_path)
+    target = (rng.random(n_rows) < cleaned[TARGET_COL].mean()).astype(np.float64)
+
+    df = pd.DataFrame({col: np.empty(n_rows) for col in FEATURE_COLS})
+    for label in (0.0, 1.0):
+        rows = target == label
+        class_values = cleaned.loc[cleaned[TARGET_COL] == label, FEATURE_COLS].to_numpy()
+        picks = rng.integers(len(class_values), size=(rows.sum(), len(FEATURE_COLS)))
+        df.loc[rows, FEATURE_COLS] = class_values[picks, np.arange(len(FEATURE_COLS))]
+    df[TARGET_COL] = target
+
+    if not raw:
+        return df
+
+    source_means = pd.read_csv(source_path)[ZERO_INVALID_COLS].mean()
+    for col in ZERO_INVALID_COLS:
+        df.loc[np.isclose(df[col], source_means[col], rtol=1e-12, atol=0), col] = 0
+    df = df.astype({col: np.int64 for col in INT_COLS})
+    df.insert(0, "ID", [f"ICU{i:09d}" for i in range(n_rows)])
+    df["Insurance"] = (rng.random(n_rows) < 0.69).astype(np.int64)
+    df["Sepssis"] = np.where(df.pop(TARGET_COL) == 1, "Positive", "Negative")
+    return df
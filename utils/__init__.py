@@ -0,0 +1,18 @@
+import importlib
+
+# Submodules are imported on first access (utils.visualization, utils.search, ...), so `import utils` stays cheap and
+# a worker only pays for the dependencies of the modules it actually uses.
+_SUBMODULES = {
+    "cache", "evaluation", "imputation", "incremental", "matrix", "processing", "profiling", "quality", "rendering",
+    "search", "serving", "sharding", "statistics", "streaming", "summaries", "visualization",
+}
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | _SUBMODULES)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+class DatasetCache:
+    """
+    An on-disk cache for the outputs of the processing pipeline, keyed by a hash of the input file bytes and the pipeline
+    parameters. Each entry is a directory of stages; a DataFrame stage is stored as .npy files and loaded back memory
+    mapped, so a warm start only reads what it touches. The least recently used entries are evicted once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(self, root: str = "../data/cache", max_bytes: int = 2 ** 30):
+        """
+        :param root: The directory to store the cache in. Defaults to "../data/cache".
+        :param max_bytes: The size the cache is trimmed down to after each write. Defaults to 1 GiB.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(paths: list[str], params: dict) -> str:
+        """
+        Computes the cache key of a pipeline run.
+        :param paths: The input files of the run. Their content is hashed, not their names or modification times.
+        :param params: The pipeline parameters. Must be JSON serializable.
+        :return: The key, as a hex string.
+        """
+        digest = hashlib.sha256()
+        for path in paths:
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            digest.update(b"\0")
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get_frame(self, key: str, stage: str) -> pd.DataFrame | None:
+        """
+        Loads a cached DataFrame, memory mapped copy-on-write: it can be modified like a freshly computed frame, and
+        changes stay in memory, never reaching the cache file.
+        :param key: The key of the pipeline run.
+        :param stage: The name of the stage.
+        :return: The DataFrame, or None on a cache miss.
+        """
+        path = os.path.join(self.root, key, stage)
+        if not os.path.exists(path + ".json"):
+            return None
+        with open(path + ".json") as file:
+            meta = json.load(file)
+        values = np.load(path + ".npy", mmap_mode="c")
+        index = np.load(path + ".index.npy")
+        self._touch(key)
+        return pd.DataFrame(values, columns=meta["columns"], index=index, copy=False)
+
+    def put_frame(self, key: str, stage: str, df: pd.DataFrame) -> None:
+        """
+        Stores a numeric DataFrame.
+        :param key: The key of the pipeline run.
+        :param stage: The name of the stage.
+        :param df: The DataFrame to store.
+        :return: None
+        """
+        path = self._entry(key, stage)
+        np.save(path + ".npy", np.ascontiguousarray(df.to_numpy(dtype=np.float64)))
+        np.save(path + ".index.npy", df.index.to_numpy())
+        # The metadata is written last, so an interrupted write is never read back
+        with open(path + ".json", "w") as file:
+            json.dump({"columns": df.columns.tolist()}, file)
+        self._evict(keep=key)
+
+    def get_object(self, key: str, stage: str):
+        """
+        Loads a cached Python object (such as a fitted Preprocessor).
+        :param key: The key of the pipeline run.
+        :param stage: The name of the stage.
+        :return: The object, or None on a cache miss.
+        """
+        path = os.path.join(self.root, key, stage + ".joblib")
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        return joblib.load(path)
+
+    def put_object(self, key: str, stage: str, obj) -> None:
+        """
+        Stores a Python object with joblib.
+        :param key: The key of the pipeline run.
+        :param stage: The name of the stage.
+        :param obj: The object to store.
+        :return: None
+        """
+        path = self._entry(key, stage)
+        joblib.dump(obj, path + ".joblib.tmp")
+        os.replace(path + ".joblib.tmp", path + ".joblib")
+        self._evict(keep=key)
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes one entry from the cache, or all of them.
+        :param key: The key of the entry to remove. Defaults to None (clear the whole cache).
+        :return: None
+        """
+        for entry in [key] if key is not None else os.listdir(self.root):
+            shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+
+    def size(self) -> int:
+        """
+        :return: The total size of the cache, in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _entry(self, key: str, stage: str) -> str:
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+        self._touch(key)
+        return os.path.join(self.root, key, stage)
+
+    def _touch(self, key: str) -> None:
+        now = time.time()
+        os.utime(os.path.join(self.root, key), (now, now))
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                size = sum(file.stat().st_size for file in os.scandir(entry.path))
+                entries.append((entry.name, size, entry.stat().st_mtime))
+        return entries
+
+    def _evict(self, keep: str) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self.invalidate(key)
+                total -= size
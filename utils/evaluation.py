@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+
+class ThresholdCurve:
+    """
+    The confusion matrix of a binary classifier at every decision threshold, computed with one sort of the scores and
+    one cumulative sum, instead of one confusion_matrix call per threshold. A row is predicted positive when its score
+    is at least the threshold (as in sklearn's roc_curve).
+    """
+
+    def __init__(self, y_true: np.ndarray, scores: np.ndarray, sample_weight: np.ndarray = None):
+        """
+        :param y_true: The true classes (0 or 1).
+        :param scores: The predicted probabilities (or any score that grows with the chance of being positive).
+        :param sample_weight: Per row weights (such as DataCSV.sample_weight). Defaults to None (unweighted).
+        """
+        y_sorted, weights, scores_sorted, last = _sort_by_score(y_true, scores, sample_weight)
+        # At each distinct score (highest first), the weight of the positive and negative rows scoring at least that
+        self.thresholds = scores_sorted[last]
+        self.tp = np.cumsum(weights * y_sorted)[last]
+        self.fp = np.cumsum(weights * (1 - y_sorted))[last]
+        self.positives = self.tp[-1]
+        self.negatives = self.fp[-1]
+
+    @property
+    def fn(self) -> np.ndarray:
+        return self.positives - self.tp
+
+    @property
+    def tn(self) -> np.ndarray:
+        return self.negatives - self.fp
+
+    @property
+    def precision(self) -> np.ndarray:
+        return _ratio(self.tp, self.tp + self.fp)
+
+    @property
+    def recall(self) -> np.ndarray:
+        return _ratio(self.tp, self.positives)
+
+    @property
+    def fpr(self) -> np.ndarray:
+        return _ratio(self.fp, self.negatives)
+
+    @property
+    def f1(self) -> np.ndarray:
+        return _ratio(2 * self.tp, self.tp + self.fp + self.positives)
+
+    @property
+    def roc_auc(self) -> float:
+        """
+        The area under the ROC curve (the same value as roc_auc_score).
+        """
+        return _auc(self.tp[None], self.fp[None])[0]
+
+    def confusion_matrix(self, threshold: float = 0.5) -> np.ndarray:
+        """
+        :param threshold: The decision threshold. Defaults to 0.5.
+        :return: The confusion matrix at that threshold, laid out as sklearn's: [[tn, fp], [fn, tp]].
+        """
+        k = _threshold_index(self.thresholds, threshold)
+        tp, fp = (self.tp[k], self.fp[k]) if k >= 0 else (0, 0)
+        return np.array([[self.negatives - fp, fp], [self.positives - tp, tp]])
+
+    def best_threshold(self, metric: str = "f1") -> float:
+        """
+        :param metric: The metric to maximize, one of "f1", "precision" or "recall". Defaults to "f1".
+        :return: The threshold with the best value of that metric.
+        """
+        return self.thresholds[np.argmax(getattr(self, metric))]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: The whole sweep, one row per distinct threshold.
+        """
+        return pd.DataFrame({
+            "threshold": self.thresholds, "tp": self.tp, "fp": self.fp, "fn": self.fn, "tn": self.tn,
+            "precision": self.precision, "recall": self.recall, "fpr": self.fpr, "f1": self.f1,
+        })
+
+
+class BootstrapResult:
+    """
+    The F1 and ROC-AUC of a classifier, with their distribution over bootstrap resamples of the evaluated rows.
+    """
+
+    def __init__(self, f1: float, roc_auc: float, f1_samples: np.ndarray, roc_auc_samples: np.ndarray,
+                 threshold: float):
+        """
+        :param f1: The F1 score on the evaluated rows.
+        :param roc_auc: The ROC-AUC on the evaluated rows.
+        :param f1_samples: The F1 score of each resample.
+        :param roc_auc_samples: The ROC-AUC of each resample (NaN for resamples holding a single class).
+        :param threshold: The decision threshold the F1 scores were computed at.
+        """
+        self.f1 = f1
+        self.roc_auc = roc_auc
+        self.f1_samples = f1_samples
+        self.roc_auc_samples = roc_auc_samples
+        self.threshold = threshold
+
+    def interval(self, metric: str = "f1", confidence: float = 0.95) -> tuple[float, float]:
+        """
+        :param metric: "f1" or "roc_auc". Defaults to "f1".
+        :param confidence: The confidence level. Defaults to 0.95.
+        :return: The percentile bootstrap confidence interval of the metric.
+        """
+        samples = getattr(self, f"{metric}_samples")
+        lower, upper = np.nanquantile(samples, [(1 - confidence) / 2, (1 + confidence) / 2])
+        return lower, upper
+
+    def summary(self, confidence: float = 0.95) -> pd.DataFrame:
+        """
+        :param confidence: The confidence level. Defaults to 0.95.
+        :return: Each metric with its confidence interval.
+        """
+        rows = {metric: [getattr(self, metric), *self.interval(metric, confidence)] for metric in ("f1", "roc_auc")}
+        return pd.DataFrame.from_dict(rows, orient="index", columns=["score", "lower", "upper"])
+
+
+def bootstrap_metrics(y_true: np.ndarray, scores: np.ndarray, n_resamples: int = 2000, threshold: float = 0.5,
+                      sample_weight: np.ndarray = None, batch_size: int = None, n_jobs: int = None,
+                      random_state: int = 0) -> BootstrapResult:
+    """
+    Bootstraps the F1 score (at a threshold) and the ROC-AUC. The rows are sorted by score once; each resample is then
+    a vector of counts over the sorted rows, so a whole batch of resamples is scored with one cumulative sum over a
+    (batch_size, n_rows) array.
+    :param y_true: The true classes (0 or 1).
+    :param scores: The predicted probabilities.
+    :param n_resamples: The number of bootstrap resamples. Defaults to 2000.
+    :param threshold: The decision threshold for the F1 score. Defaults to 0.5.
+    :param sample_weight: Per row weights. Defaults to None (unweighted).
+    :param batch_size: The number of resamples scored at once. Defaults to None (about 4M counts per batch).
+    :param n_jobs: The number of batches scored in parallel, as for joblib. Defaults to None (serial).
+    :param random_state: Seed for reproducible resamples. The result does not depend on n_jobs. Defaults to 0.
+    :return: The BootstrapResult.
+    """
+    y_sorted, weights, scores_sorted, last = _sort_by_score(y_true, scores, sample_weight)
+    k = _threshold_index(scores_sorted, threshold)
+    batch_size = batch_size or max(1, 2 ** 22 // len(y_sorted))
+    sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    batches = Parallel(n_jobs=n_jobs)(
+        delayed(_bootstrap_batch)(y_sorted, weights, last, k, size, seed) for size, seed in zip(sizes, seeds)
+    )
+    f1, roc_auc = _score_counts(y_sorted, weights[None], last, k)
+    return BootstrapResult(f1[0], roc_auc[0], np.concatenate([batch[0] for batch in batches]),
+                           np.concatenate([batch[1] for batch in batches]), threshold)
+
+
+def bootstrap_candidates(y_true: np.ndarray, candidate_scores: list[np.ndarray], n_resamples: int = 2000,
+                         threshold: float = 0.5, confidence: float = 0.95, n_jobs: int = None,
+                         random_state: int = 0) -> dict[str, np.ndarray]:
+    """
+    Bootstraps the F1 and ROC-AUC confidence interval of every candidate of a search, for visualize_training.
+    :param y_true: The true classes (0 or 1) of the evaluated rows.
+    :param candidate_scores: The predicted probabilities of each candidate on those rows, e.g. from
+    cross_val_predict(..., method="predict_proba").
+    :param n_resamples: The number of bootstrap resamples. Defaults to 2000.
+    :param threshold: The decision threshold for the F1 score. Defaults to 0.5.
+    :param confidence: The confidence level. Defaults to 0.95.
+    :param n_jobs: The number of batches scored in parallel, as for joblib. Defaults to None (serial).
+    :param random_state: Seed for reproducible resamples. Defaults to 0.
+    :return: For "f1" and "roc_auc", a (2, n_candidates) array of lower and upper bounds.
+    """
+    results = [bootstrap_metrics(y_true, scores, n_resamples, threshold, n_jobs=n_jobs, random_state=random_state)
+               for scores in candidate_scores]
+    return {metric: np.array([result.interval(metric, confidence) for result in results]).T
+            for metric in ("f1", "roc_auc")}
+
+
+def _bootstrap_batch(y_sorted: np.ndarray, weights: np.ndarray, last: np.ndarray, k: int, size: int,
+                     seed: np.random.SeedSequence) -> tuple[np.ndarray, np.ndarray]:
+    n = len(y_sorted)
+    rows = np.random.default_rng(seed).integers(0, n, (size, n))
+    rows += np.arange(size)[:, None] * n
+    counts = np.bincount(rows.ravel(), minlength=size * n).reshape(size, n)
+    return _score_counts(y_sorted, counts * weights, last, k)
+
+
+def _score_counts(y_sorted: np.ndarray, weights: np.ndarray, last: np.ndarray,
+                  k: int) -> tuple[np.ndarray, np.ndarray]:
+    # weights holds one row of per sample weights for each resample, over the rows sorted by descending score
+    tp = np.cumsum(weights * y_sorted, axis=1)
+    fp = np.cumsum(weights * (1 - y_sorted), axis=1)
+    positives = tp[:, -1]
+    f1 = _ratio(2 * tp[:, k], tp[:, k] + fp[:, k] + positives) if k >= 0 else np.zeros(len(weights))
+    return f1, _auc(tp[:, last], fp[:, last])
+
+
+def _auc(tp: np.ndarray, fp: np.ndarray) -> np.ndarray:
+    # Trapezoidal area under the (unnormalized) ROC curve of each row, normalized by positives * negatives
+    tp = np.pad(tp, ((0, 0), (1, 0)))
+    fp = np.pad(fp, ((0, 0), (1, 0)))
+    area = (np.diff(fp, axis=1) * (tp[:, 1:] + tp[:, :-1])).sum(axis=1) / 2
+    return _ratio(area, tp[:, -1] * fp[:, -1], empty=np.nan)
+
+
+def _sort_by_score(y_true: np.ndarray, scores: np.ndarray,
+                   sample_weight: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    order = np.argsort(-scores, kind="mergesort")
+    weights = np.ones(len(order)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)[order]
+    scores_sorted = scores[order]
+    # The last row of each run of tied scores: the cumulative sums are only read there
+    last = np.r_[np.flatnonzero(np.diff(scores_sorted)), len(order) - 1]
+    return y_true[order], weights, scores_sorted, last
+
+
+def _threshold_index(scores_desc: np.ndarray, threshold: float) -> int:
+    # The position of the last score at or above the threshold, -1 if there is none
+    return int(np.searchsorted(-scores_desc, -threshold, side="right")) - 1
+
+
+def _ratio(numerator, denominator, empty: float = 0.0):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, empty)
@@ -0,0 +1,91 @@
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+
+class NeighborImputer:
+    """
+    A scalable replacement for sklearn's KNNImputer. Missing cells are filled with the mean of the nearest complete
+    rows (the donors), measured on the features the row does have. A spatial index is built once per missing-value
+    pattern and all rows sharing that pattern are imputed with batched queries, processed in chunks so memory stays
+    bounded. This avoids the O(n²) pairwise distance matrix KNNImputer computes.
+    """
+
+    def __init__(self, n_neighbors: int = 30, algorithm: str = "kd_tree", leaf_size: int = 40, chunk_size: int = 10_000):
+        """
+        :param n_neighbors: The number of donors to average over. Defaults to 30.
+        :param algorithm: The spatial index to use, either "kd_tree" or "ball_tree". Defaults to "kd_tree".
+        :param leaf_size: The leaf size of the spatial index. Defaults to 40.
+        :param chunk_size: The maximum number of rows queried at once. Defaults to 10,000.
+        """
+        self.n_neighbors = n_neighbors
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.chunk_size = chunk_size
+
+    def fit(self, X: np.ndarray) -> "NeighborImputer":
+        """
+        Stores the complete rows of X as donors. Indexes are built lazily, the first time a pattern is imputed.
+        :param X: A 2D float array, with missing values marked as NaN.
+        :return: The fitted NeighborImputer itself.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        self.col_means_ = np.nanmean(X, axis=0)
+        self.donors_ = np.ascontiguousarray(X[~np.isnan(X).any(axis=1)])
+        self._indexes = {}
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """
+        Imputes all the missing cells of X.
+        :param X: A 2D float array, with missing values marked as NaN.
+        :return: A copy of X with the missing values filled in.
+        """
+        X = np.array(X, dtype=np.float64)
+        missing = np.isnan(X)
+        receivers = np.flatnonzero(missing.any(axis=1))
+        if receivers.size == 0:
+            return X
+
+        # 1-D fast path: a receiver has no coordinate left to measure distance with, so (like KNNImputer) every missing
+        # cell gets the column mean. Rows missing every feature elsewhere are handled the same way.
+        n_donors = min(self.n_neighbors, len(self.donors_))
+        if X.shape[1] == 1 or n_donors == 0:
+            np.copyto(X, self.col_means_, where=missing)
+            return X
+
+        patterns, pattern_ids = np.unique(missing[receivers], axis=0, return_inverse=True)
+        for pattern_id, pattern in enumerate(patterns):
+            rows = receivers[pattern_ids.ravel() == pattern_id]
+            if pattern.all():
+                X[np.ix_(rows, pattern)] = self.col_means_
+                continue
+
+            index = self._index(pattern)
+            observed = np.flatnonzero(~pattern)
+            donor_values = self.donors_[:, pattern]
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = rows[start:start + self.chunk_size]
+                neighbors = index.query(X[np.ix_(chunk, observed)], k=n_donors, return_distance=False)
+                X[np.ix_(chunk, pattern)] = donor_values[neighbors].mean(axis=1)
+        return X
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray:
+        """
+        Fits the imputer on X, then imputes all the missing cells of X.
+        :param X: A 2D float array, with missing values marked as NaN.
+        :return: A copy of X with the missing values filled in.
+        """
+        return self.fit(X).transform(X)
+
+    def _index(self, pattern: np.ndarray) -> "KDTree | BallTree":
+        key = pattern.tobytes()
+        if key not in self._indexes:
+            tree = KDTree if self.algorithm == "kd_tree" else BallTree
+            self._indexes[key] = tree(self.donors_[:, ~pattern], leaf_size=self.leaf_size)
+        return self._indexes[key]
+
+    def __getstate__(self) -> dict:
+        # Indexes are cheap to rebuild, so they are not persisted
+        state = self.__dict__.copy()
+        state["_indexes"] = {}
+        return state
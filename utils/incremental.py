@@ -0,0 +1,111 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+
+from utils.processing import FEATURE_COLS, TARGET_COL, _prepare
+from utils.streaming import TrainingStatistics, read_csv_chunks
+
+
+class IncrementalModel:
+    """
+    Trains a sepsis classifier batch by batch, so new labelled patients are incorporated without rebuilding DataCSV or
+    re-running the grid search. Each batch updates the running training statistics (zero-replacement means, quantile
+    sketches for the IQR bounds, scaler moments), the Preprocessor is re-derived from them, and a logistic regression
+    fitted by SGD takes a few passes over the batch. Classes are balanced by weighting each sample by the running class
+    frequencies rather than by upsampling the positives.
+
+    Since the Preprocessor moves a little with every batch, the model sees slightly differently scaled features over
+    time; the drift vanishes as the statistics settle.
+    """
+
+    def __init__(self, alpha: float = 1e-4, eta0: float = 0.1, epochs: int = 5, sketch_size: int = 4096,
+                 whisker_width: float = 1.5, added_const: float = 0.001, random_state: int = 0):
+        """
+        :param alpha: The L2 regularization strength of the SGDClassifier. Defaults to 1e-4.
+        :param eta0: The initial learning rate of the SGDClassifier, which decays with the number of samples seen
+        (invscaling), so early batches are not overwritten by later ones. Defaults to 0.1.
+        :param epochs: The number of passes over each batch. Defaults to 5.
+        :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+        :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+        :param added_const: The constant added to non-zero values before taking their log. Defaults to 0.001.
+        :param random_state: Seed for the shuffling of each batch and for the SGDClassifier. Defaults to 0.
+        """
+        self.epochs = epochs
+        self.whisker_width = whisker_width
+        self.added_const = added_const
+        self.stats = TrainingStatistics(sketch_size)
+        self.class_counts = np.zeros(2, dtype=np.int64)
+        self.model = SGDClassifier(loss="log_loss", alpha=alpha, learning_rate="invscaling", eta0=eta0,
+                                   random_state=random_state)
+        self.preprocessor = None
+        self._rng = np.random.default_rng(random_state)
+
+    def partial_fit(self, batch: pd.DataFrame) -> "IncrementalModel":
+        """
+        Updates the statistics and the model with a batch of new labelled patients. Rows without a label are ignored.
+        :param batch: A DataFrame with the Paitients_Files schema, including the target column.
+        :return: The updated IncrementalModel itself.
+        """
+        batch = _prepare(batch).dropna(subset=[TARGET_COL])
+        if batch.empty:
+            return self
+        y = batch[TARGET_COL].to_numpy(dtype=np.int64)
+        self.stats.update(batch)
+        self.class_counts += np.bincount(y, minlength=2)
+        self.preprocessor = self.stats.to_preprocessor(self.whisker_width, self.added_const)
+
+        X = self.preprocessor.transform_values(batch[FEATURE_COLS].to_numpy(dtype=np.float64, copy=True), clean=True)
+        sample_weight = self.class_weights()[y]
+        for _ in range(self.epochs):
+            order = self._rng.permutation(len(y))
+            self.model.partial_fit(X[order], y[order], classes=[0, 1], sample_weight=sample_weight[order])
+        return self
+
+    def class_weights(self) -> np.ndarray:
+        """
+        :return: The weight of each class, n_samples / (n_classes * class count), as class_weight="balanced" would
+        compute it on every sample seen so far.
+        """
+        with np.errstate(divide="ignore"):
+            return np.where(self.class_counts > 0, self.class_counts.sum() / (2 * self.class_counts), 1.0)
+
+    def predict_proba(self, df: pd.DataFrame, clean: bool = True) -> np.ndarray:
+        """
+        Scores a batch of patients.
+        :param df: A DataFrame with the Paitients_Files schema (ID, Insurance and the target column are optional).
+        :param clean: Also replace zeros and treat outliers (see Preprocessor.transform). Defaults to True.
+        :return: The probability of sepsis of each row.
+        """
+        return self.model.predict_proba(self.preprocessor.transform(df, clean)[FEATURE_COLS].to_numpy())[:, 1]
+
+    def save(self, preprocessor_path: str, model_path: str) -> None:
+        """
+        Publishes the current Preprocessor and model, in the format ScoringService loads. Each file is replaced
+        atomically, so a reader never sees a partially written file.
+        :param preprocessor_path: The file to save the Preprocessor to.
+        :param model_path: The file to save the model to.
+        :return: None
+        """
+        self.preprocessor.save(preprocessor_path + ".tmp")
+        joblib.dump(self.model, model_path + ".tmp")
+        os.replace(preprocessor_path + ".tmp", preprocessor_path)
+        os.replace(model_path + ".tmp", model_path)
+
+
+def fit_incremental(train_data_path: str, chunk_size: int = 100_000,
+                    model: IncrementalModel = None) -> IncrementalModel:
+    """
+    Feeds a labelled CSV to an IncrementalModel chunk by chunk (dropping duplicated rows, like the training data
+    cleaning does), e.g. to bootstrap it from the training dataset or to catch up on a file of new patients.
+    :param train_data_path: The path to the labelled dataset file.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param model: The IncrementalModel to update. Defaults to None (a new IncrementalModel).
+    :return: The updated IncrementalModel.
+    """
+    model = model if model is not None else IncrementalModel()
+    for chunk in read_csv_chunks(train_data_path, chunk_size, drop_duplicates=True):
+        model.partial_fit(chunk)
+    return model
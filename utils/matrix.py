@@ -0,0 +1,150 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import check_cv
+
+
+class FeatureMatrix:
+    """
+    The features of a dataset held once, as a single contiguous C-ordered array (float64, or float32 to halve the
+    memory), together with the column names, the target, optional sample weights and the cross-validation fold indices.
+    The array can be backed by a memory mapped .npy file. Everything handed out (X, y, frame(), split()) is a view of
+    that one array, so estimators and the plotting helpers never hold a copy of the features.
+    """
+
+    def __init__(self, X: np.ndarray, columns: list[str], y: np.ndarray = None, sample_weight: np.ndarray = None,
+                 folds: list[tuple[np.ndarray, np.ndarray]] = None):
+        """
+        :param X: The 2D feature array. Used as is if it is already C-ordered float32 or float64 (which includes
+        memory mapped arrays), otherwise converted to float64.
+        :param columns: The name of each column of X.
+        :param y: The target. Defaults to None (unlabelled data).
+        :param sample_weight: Per row weights (such as DataCSV.sample_weight). Defaults to None (unweighted).
+        :param folds: The (train, test) row indices of each cross-validation fold. Defaults to None (see with_folds).
+        """
+        if X.dtype not in (np.float32, np.float64) or not X.flags.c_contiguous:
+            X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(columns):
+            raise ValueError(f"X has shape {X.shape}, which does not match the {len(columns)} columns.")
+        self.X = X
+        self.columns = list(columns)
+        self.y = y
+        self.sample_weight = sample_weight
+        self.folds = folds
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, target_col: str | None = "Sepsis", dtype: type = np.float64,
+                   sample_weight: np.ndarray = None, path: str = None) -> "FeatureMatrix":
+        """
+        Builds a FeatureMatrix from a DataFrame (such as DataCSV.train), writing each column straight into the feature
+        array, so no intermediate float64 copy of the whole frame is made.
+        :param df: The DataFrame.
+        :param target_col: The target column, which is kept out of the features. Ignored if df has no such column.
+        Defaults to "Sepsis".
+        :param dtype: np.float64, or np.float32 to halve the memory. Defaults to np.float64.
+        :param sample_weight: Per row weights. Defaults to None (unweighted).
+        :param path: A .npy file to back the feature array with, so it lives on disk and is paged in as needed.
+        Defaults to None (in memory).
+        :return: The FeatureMatrix.
+        """
+        columns = [col for col in df.columns if col != target_col]
+        shape = (len(df), len(columns))
+        if path is not None:
+            X = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        else:
+            X = np.empty(shape, dtype=dtype)
+        for j, col in enumerate(columns):
+            X[:, j] = df[col].to_numpy()
+        if path is not None:
+            X.flush()
+        y = df[target_col].to_numpy() if target_col in df else None
+        return cls(X, columns, y, sample_weight)
+
+    def with_folds(self, cv=None, groups: np.ndarray = None) -> "FeatureMatrix":
+        """
+        Computes the cross-validation folds once, so every search reuses the same index arrays.
+        :param cv: The cross-validation splitter, or number of folds, as for GridSearchCV. Defaults to None (5 folds).
+        :param groups: Group labels, for group-aware splitters. Defaults to None.
+        :return: The FeatureMatrix itself, with its folds set.
+        """
+        splitter = check_cv(cv, self.y, classifier=self.y is not None)
+        self.folds = [(train, test) for train, test in splitter.split(self.X, self.y, groups)]
+        return self
+
+    def frame(self, target_col: str = "Sepsis") -> pd.DataFrame:
+        """
+        :param target_col: The name to give the target column. Defaults to "Sepsis".
+        :return: The features (and target, if any) as a DataFrame for the utils.visualization helpers. The features are
+        a view of X, not a copy.
+        """
+        df = pd.DataFrame(self.X, columns=self.columns, copy=False)
+        if self.y is not None:
+            df[target_col] = self.y
+        return df
+
+    def split(self, test_size: float = 0.2) -> tuple["FeatureMatrix", "FeatureMatrix"]:
+        """
+        Splits the rows into a leading train part and a trailing validation part, both views of X. Rows are not
+        shuffled, so shuffle the data once beforehand (see shuffled) if its order is meaningful.
+        :param test_size: The share of rows in the validation part. Defaults to 0.2.
+        :return: The train and validation FeatureMatrix.
+        """
+        n_train = len(self) - int(np.ceil(len(self) * test_size))
+        return self[:n_train], self[n_train:]
+
+    def shuffled(self, random_state: int = 0) -> "FeatureMatrix":
+        """
+        :param random_state: Seed for reproducible results. Defaults to 0.
+        :return: A copy with its rows in random order (the one copy needed for split to return random views). Folds
+        are not carried over.
+        """
+        order = np.random.default_rng(random_state).permutation(len(self))
+        return FeatureMatrix(self.X[order], self.columns, _take(self.y, order), _take(self.sample_weight, order))
+
+    def save(self, path: str) -> None:
+        """
+        Saves the matrix into a directory, to be memory mapped back with load.
+        :param path: The directory to save to.
+        :return: None
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "X.npy"), self.X)
+        arrays = {"y": self.y, "sample_weight": self.sample_weight}
+        for fold, (train, test) in enumerate(self.folds or []):
+            arrays[f"train{fold}"], arrays[f"test{fold}"] = train, test
+        np.savez(os.path.join(path, "arrays.npz"), **{name: a for name, a in arrays.items() if a is not None})
+        # The metadata is written last, so an interrupted save is never loaded
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump({"columns": self.columns, "n_folds": len(self.folds or [])}, file)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "FeatureMatrix":
+        """
+        Loads a matrix saved with save.
+        :param path: The directory it was saved to.
+        :param mmap_mode: How to memory map the features, as for np.load. Defaults to "r" (read-only).
+        :return: The FeatureMatrix.
+        """
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        X = np.load(os.path.join(path, "X.npy"), mmap_mode=mmap_mode)
+        with np.load(os.path.join(path, "arrays.npz")) as arrays:
+            folds = [(arrays[f"train{fold}"], arrays[f"test{fold}"]) for fold in range(meta["n_folds"])]
+            return cls(X, meta["columns"], arrays.get("y"), arrays.get("sample_weight"), folds or None)
+
+    def __len__(self) -> int:
+        return self.X.shape[0]
+
+    def __getitem__(self, rows: slice) -> "FeatureMatrix":
+        if not isinstance(rows, slice):
+            raise TypeError("Only slices are supported, since they are views; use shuffled for a random order.")
+        # A stepped slice is a view, but not a contiguous one, so __init__ would quietly copy it
+        if rows.step not in (None, 1):
+            raise ValueError(f"Only slices with a step of 1 are views of contiguous rows, got a step of {rows.step}.")
+        return FeatureMatrix(self.X[rows], self.columns, _take(self.y, rows), _take(self.sample_weight, rows))
+
+
+def _take(values: np.ndarray | None, rows) -> np.ndarray | None:
+    return None if values is None else values[rows]
@@ -1,11 +1,168 @@
+from functools import cached_property
+
+import joblib
 import pandas as pd
 import numpy as np
 
-from sklearn.impute import KNNImputer
-from sklearn.preprocessing import StandardScaler
-from sklearn.utils import resample
+from utils.cache import DatasetCache
+from utils.profiling import PipelineProfiler
+
+# sklearn, matplotlib and seaborn are only imported where they are used (fitting, up-sampling and plotting), so a
+# worker that only transforms batches with a saved Preprocessor starts without them.
+
+
+FEATURE_COLS = ['PRG', 'PL', 'PR', 'SK', 'TS', 'M11', 'BD2', 'Age']
+ZERO_INVALID_COLS = ['PRG', 'PL', 'PR', 'SK', 'TS', 'M11', 'BD2']  # Zero is not a valid reading for these
+TARGET_COL = "Sepsis"
+
+
+class Preprocessor:
+    """
+    A fit/transform version of the cleaning and processing pipeline. All the statistics it needs are learned once from
+    the training data, so new batches of patients can be transformed without touching the training dataset again.
+    """
+
+    def __init__(self, imputer_n_neighbors: int = 30, whisker_width: float = 1.5, added_const: float = 0.001,
+                 multivariate_imputation: bool = False):
+        """
+        :param imputer_n_neighbors: The number of neighbors to use in the KNN imputer to deal with outliers. Defaults to 30.
+        :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+        :param added_const: The constant added to non-zero values before taking their log. Defaults to 0.001.
+        :param multivariate_imputation: Impute outliers from their nearest neighbours across all features with a
+        NeighborImputer, instead of column by column. Defaults to False.
+        """
+        self.imputer_n_neighbors = imputer_n_neighbors
+        self.whisker_width = whisker_width
+        self.added_const = added_const
+        self.multivariate_imputation = multivariate_imputation
+
+    def fit(self, train: pd.DataFrame) -> "Preprocessor":
+        """
+        Learns the zero-replacement means, the outlier bounds, the imputers and the scaler from the training data.
+        :param train: The raw training DataFrame, as read from Paitients_Files_Train.csv.
+        :return: The fitted Preprocessor itself.
+        """
+        self.fit_transform(train)
+        return self
+
+    def fit_transform(self, train: pd.DataFrame, profiler: PipelineProfiler = None) -> pd.DataFrame:
+        """
+        Fits the preprocessor and returns the fully cleaned and processed training data (not yet class balanced).
+        :param train: The raw training DataFrame, as read from Paitients_Files_Train.csv.
+        :param profiler: A PipelineProfiler to record each stage with. Defaults to None (no profiling).
+        :return: The processed training DataFrame.
+        """
+        profiler = profiler if profiler is not None else PipelineProfiler(enabled=False)
+        return self._fit_scale(self._fit_clean(train, profiler), profiler)
+
+    def _fit_clean(self, train: pd.DataFrame, profiler: PipelineProfiler) -> pd.DataFrame:
+        # The cleaning half of fit_transform: de-duplicated, zeros replaced and outliers treated, not yet log scaled
+        with profiler.stage("drop_duplicates", len(train)) as stage:
+            train = _prepare(train.drop_duplicates(inplace=False))
+            train.drop_duplicates(inplace=True)
+            stage.rows_out = len(train)
+
+        with profiler.stage("zero_replacement", len(train)):
+            self.zero_means_ = {col: train[col].mean() for col in ZERO_INVALID_COLS}
+            for col in ZERO_INVALID_COLS:
+                train[col] = train[col].replace(0, self.zero_means_[col])
+
+        with profiler.stage("impute_outliers", len(train)):
+            values = np.asfortranarray(train[FEATURE_COLS].to_numpy(dtype=np.float64))
+            self.imputer_ = None
+            if self.multivariate_imputation:
+                from utils.imputation import NeighborImputer
+                self.imputer_ = NeighborImputer(self.imputer_n_neighbors)
+            self.impute_bounds_, self.impute_values_ = _impute_outliers(values, self.whisker_width, self.imputer_)
+
+        with profiler.stage("cap_outliers", len(train)):
+            self.cap_bounds_ = _cap_outliers(values, self.whisker_width)
+        train[FEATURE_COLS] = values
+        return train
+
+    def _fit_scale(self, train: pd.DataFrame, profiler: PipelineProfiler) -> pd.DataFrame:
+        # The rest of fit_transform, on the output of _fit_clean, which is modified in-place
+        from sklearn.preprocessing import StandardScaler
+
+        with profiler.stage("log_scale", len(train)):
+            train[FEATURE_COLS] = self._log(train[FEATURE_COLS].to_numpy(dtype=np.float64))
+            self.scaler_ = StandardScaler().fit(train[FEATURE_COLS])
+            train[FEATURE_COLS] = self.scaler_.transform(train[FEATURE_COLS])
+        return train
+
+    def transform(self, df: pd.DataFrame, clean: bool = True) -> pd.DataFrame:
+        """
+        Transforms a batch of new patients using the learned state. Rows are never dropped, so the output lines up
+        with the input batch row for row.
+        :param df: A DataFrame with the Paitients_Files schema (ID, Insurance and the target column are optional).
+        :param clean: Also replace zeros and treat outliers using the training statistics. Defaults to True, since the
+        scaler was fitted on cleaned data: an uncleaned zero reading scales to tens of standard deviations. Pass False
+        for data that is already clean.
+        :return: The transformed DataFrame.
+        """
+        df = _prepare(df)
+        values = self.transform_values(df[FEATURE_COLS].to_numpy(dtype=np.float64, copy=True), clean)
+        df = df.astype({col: np.float64 for col in FEATURE_COLS})
+        df[FEATURE_COLS] = values
+        return df
+
+    def clean(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replaces zeros and treats outliers in a batch of new patients using the learned state, without the log
+        transform and scaling: transform(clean(df), clean=False) equals transform(df).
+        :param df: A DataFrame with the Paitients_Files schema (ID, Insurance and the target column are optional).
+        :return: The cleaned DataFrame.
+        """
+        df = _prepare(df)
+        values = self._clean(df[FEATURE_COLS].to_numpy(dtype=np.float64, copy=True))
+        df = df.astype({col: np.float64 for col in FEATURE_COLS})
+        df[FEATURE_COLS] = values
+        return df
+
+    def transform_values(self, values: np.ndarray, clean: bool = True) -> np.ndarray:
+        """
+        The array version of transform, for callers that already hold the features as a float array.
+        :param values: A 2D float array with the FEATURE_COLS columns, in order. May be modified in-place.
+        :param clean: Also replace zeros and treat outliers using the training statistics. Defaults to True.
+        :return: The transformed array.
+        """
+        if clean:
+            values = self._clean(values)
+        return (self._log(values) - self.scaler_.mean_) / self.scaler_.scale_
+
+    def save(self, path: str) -> None:
+        """
+        Persists the fitted preprocessor to disk.
+        :param path: The file to save to.
+        :return: None
+        """
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "Preprocessor":
+        """
+        Loads a preprocessor previously persisted with save().
+        :param path: The file to load from.
+        :return: The fitted Preprocessor.
+        """
+        return joblib.load(path)
+
+    def _clean(self, values: np.ndarray) -> np.ndarray:
+        # Zero replacement, outlier imputation and capping, before the log transform and scaling
+        for i, col in enumerate(FEATURE_COLS):
+            if col in self.zero_means_:
+                values[values[:, i] == 0, i] = self.zero_means_[col]
+        outliers = (values < self.impute_bounds_[0]) | (values > self.impute_bounds_[1])
+        if self.imputer_ is None:
+            values = np.where(outliers, self.impute_values_, values)
+        else:
+            values[outliers] = np.nan
+            values = self.imputer_.transform(values)
+        np.clip(values, self.cap_bounds_[0], self.cap_bounds_[1], out=values)
+        return values
 
-from utils.visualization import show_aggregate_distribution, show_boxplots
+    def _log(self, values: np.ndarray) -> np.ndarray:
+        return np.where(values != 0, np.log(values + self.added_const), 0)
 
 
 class DataCSV:
@@ -13,60 +170,110 @@ class DataCSV:
     A class for processing CSV data for machine leaning algorithms.
     """
 
-    def __init__(self, train_data_path: str, predict_data_path: str, imputer_n_neighbors: int = 30):
+    def __init__(self, train_data_path: str, predict_data_path: str, imputer_n_neighbors: int = 30,
+                 random_state: int = 0, cache: DatasetCache = None, profiler: PipelineProfiler = None,
+                 balance: str | None = "upsample"):
         """
         A class to automate cleaning and processing data.
         :param train_data_path: The path to the training dataset file.
         :param predict_data_path: The path to the test dataset file.
         :param imputer_n_neighbors: The number of neighbors to use in the KNN imputer to deal with outliers. Defaults to 30.
+        :param random_state: The seed used to up-sample the positive class. Defaults to 0.
+        :param cache: A DatasetCache to load the results from, or store them into on a cache miss. Both the cleaned
+        frames (self.cleaned_train, before class balancing, and self.cleaned_predict) and the processed ones are cached.
+        Cached DataFrames are memory mapped copy-on-write, so they can be modified like uncached ones. Defaults to None
+        (no caching).
+        :param profiler: A PipelineProfiler to record each stage of the pipeline with. Its report is also available
+        as self.profile. Defaults to None (no profiling).
+        :param balance: How to balance the classes of the training data: "upsample" duplicates positive rows until the
+        classes are 1:1, "weight" keeps every row once and sets self.sample_weight instead (see
+        balanced_sample_weight), None leaves the classes as they are. Defaults to "upsample".
+        """
+        if balance not in ("upsample", "weight", None):
+            raise ValueError(f"Unknown balance {balance!r}, expected 'upsample', 'weight' or None.")
+        self.train_data_path = train_data_path
+        self.predict_data_path = predict_data_path
+        self.preprocessor = Preprocessor(imputer_n_neighbors=imputer_n_neighbors)
+        self.profiler = profiler if profiler is not None else PipelineProfiler(enabled=False)
+        self.balance = balance
+        self.sample_weight = None
+
+        if cache is not None:
+            with self.profiler.stage("cache_lookup", 0) as stage:
+                key = cache.key([train_data_path, predict_data_path],
+                                {**vars(self.preprocessor), "random_state": random_state, "balance": balance,
+                                 "clean_predict": True})
+                self.train, self.predict = cache.get_frame(key, "train"), cache.get_frame(key, "predict")
+                self.cleaned_train = cache.get_frame(key, "cleaned_train")
+                self.cleaned_predict = cache.get_frame(key, "cleaned_predict")
+                preprocessor = cache.get_object(key, "preprocessor")
+                frames = (self.train, self.predict, self.cleaned_train, self.cleaned_predict)
+                hit = all(frame is not None for frame in frames) and preprocessor is not None
+                stage.rows_out = len(self.train) if hit else 0
+            if hit:
+                self.preprocessor = preprocessor
+                if balance == "weight":
+                    self.sample_weight = balanced_sample_weight(self.train[TARGET_COL].to_numpy())
+                return
+
+        with self.profiler.stage("read_csv", 0) as stage:
+            stage.rows_out = len(self.source_train) + len(self.source_predict)
+
+        # Cleaning and processing. The test data is cleaned and scaled with the statistics learned from the train data.
+        # The cleaned frames, before the log transform and scaling, are kept as well (like data/cleaned_*.csv).
+        self.cleaned_train = self.preprocessor._fit_clean(self.source_train, self.profiler)
+        self.train = self.preprocessor._fit_scale(self.cleaned_train.copy(), self.profiler)
+        with self.profiler.stage("transform_predict", len(self.source_predict)):
+            self.cleaned_predict = self.preprocessor.clean(self.source_predict)
+            self.predict = self.preprocessor.transform(self.cleaned_predict, clean=False)
+
+        if balance == "upsample":
+            from sklearn.utils import resample
+
+            with self.profiler.stage("resample", len(self.train)) as stage:
+                negatives = self.train[self.train["Sepsis"] == 0]
+                positives = self.train[self.train["Sepsis"] == 1]
+                positives_up_sampled = resample(
+                    positives,
+                    replace=True,  # sample with replacement
+                    n_samples=len(negatives),  # 1:1 balanced
+                    random_state=random_state  # reproducible results
+                )
+
+                self.train = pd.concat([negatives, positives_up_sampled])
+                stage.rows_out = len(self.train)
+        elif balance == "weight":
+            with self.profiler.stage("sample_weight", len(self.train)):
+                self.sample_weight = balanced_sample_weight(self.train[TARGET_COL].to_numpy())
+
+        if cache is not None:
+            with self.profiler.stage("cache_store", len(self.train)):
+                cache.put_frame(key, "train", self.train)
+                cache.put_frame(key, "predict", self.predict)
+                cache.put_frame(key, "cleaned_train", self.cleaned_train)
+                cache.put_frame(key, "cleaned_predict", self.cleaned_predict)
+                cache.put_object(key, "preprocessor", self.preprocessor)
+
+    @property
+    def profile(self) -> pd.DataFrame:
+        """
+        The stage report of the PipelineProfiler passed in (empty without one).
+        """
+        return self.profiler.report()
+
+    @cached_property
+    def source_train(self) -> pd.DataFrame:
+        """
+        The raw training dataset. Only read from disk when needed.
         """
-        self.source_train = pd.read_csv(train_data_path)
-        self.source_predict = pd.read_csv(predict_data_path)
-
-        # Cleaning
-        self.train = self.source_train.drop_duplicates(inplace=False)
-        self.train = self.train.drop(columns=['ID', 'Insurance'])
-        self.predict = self.source_predict.drop(columns=['ID', 'Insurance'])
-        self.train.drop_duplicates(inplace=True)
-
-        self.train['PRG'] = self.train['PRG'].replace(0, self.train['PRG'].mean())
-        self.train['PL'] = self.train['PL'].replace(0, self.train['PL'].mean())
-        self.train['PR'] = self.train['PR'].replace(0, self.train['PR'].mean())
-        self.train['SK'] = self.train['SK'].replace(0, self.train['SK'].mean())
-        self.train['TS'] = self.train['TS'].replace(0, self.train['TS'].mean())
-        self.train['M11'] = self.train['M11'].replace(0, self.train['M11'].mean())
-        self.train['BD2'] = self.train['BD2'].replace(0, self.train['BD2'].mean())
-
-        self.train = self.train.rename(columns={"Sepssis": "Sepsis"})
-        self.train["Sepsis"] = self.train["Sepsis"].map({"Negative": 0.0, "Positive": 1.0})
-
-        # Processing
-        for col in self.train.columns:
-            if col == "Sepsis":  # Target column does not have outliers, as it is categorical
-                continue
-            impute_outliers_iqr(col, self.train, KNNImputer(n_neighbors=imputer_n_neighbors))
-            cap_outliers_iqr(col, self.train)
-
-        scaler = StandardScaler()
-        added_const = 0.001
-        for col in self.train.columns:
-            if col == "Sepsis":
-                continue
-            self.train[col] = np.where(self.train[col] != 0, np.log(self.train[col] + added_const), 0)
-            self.predict[col] = np.where(self.predict[col] != 0, np.log(self.predict[col] + added_const), 0)
-            self.train[[col]] = scaler.fit_transform(self.train[[col]])
-            self.predict[[col]] = scaler.fit_transform(self.predict[[col]])
-
-        negatives = self.train[self.train["Sepsis"] == 0]
-        positives = self.train[self.train["Sepsis"] == 1]
-        positives_up_sampled = resample(
-            positives,
-            replace=True,  # sample with replacement
-            n_samples=len(negatives),  # 1:1 balanced
-            random_state=0  # reproducible results
-        )
-
-        self.train = pd.concat([negatives, positives_up_sampled])
+        return pd.read_csv(self.train_data_path)
+
+    @cached_property
+    def source_predict(self) -> pd.DataFrame:
+        """
+        The raw test dataset. Only read from disk when needed.
+        """
+        return pd.read_csv(self.predict_data_path)
 
     def show_distribution(self) -> None:
         """
@@ -74,6 +281,7 @@ class DataCSV:
         overlaid on top of each other (except for the target column).
         :return: None
         """
+        from utils.visualization import show_aggregate_distribution
         show_aggregate_distribution(self.train, self.predict)
 
     def show_boxplots(self) -> None:
@@ -81,17 +289,87 @@ class DataCSV:
         Shows comparison histograms and accompanying box plots for col of both train and test DataFrame.
         :return: None
         """
+        from utils.visualization import show_boxplots
         show_boxplots(self.train, self.predict)
 
 
-def impute_outliers_iqr(col: str, df: pd.DataFrame, imputer, whisker_width: float = 1.5) -> None:
+def balanced_sample_weight(y: np.ndarray) -> np.ndarray:
+    """
+    Per row weights that balance the classes the way up-sampling does, without duplicating any row: the majority class
+    keeps a weight of 1 and every other class is weighted by how many times it would have been up-sampled, so the
+    weights sum to the size of the up-sampled data.
+    :param y: The class of each row.
+    :return: The weight of each row.
+    """
+    classes, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    return (counts.max() / counts)[inverse]
+
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.drop(columns=['ID', 'Insurance'], errors="ignore")
+    if "Sepssis" in df.columns:
+        df = df.rename(columns={"Sepssis": TARGET_COL})
+        df[TARGET_COL] = df[TARGET_COL].map({"Negative": 0.0, "Positive": 1.0}).astype(np.float64)
+    return df
+
+
+def iqr_bounds(values: np.ndarray, whisker_width: float = 1.5) -> np.ndarray:
+    """
+    Calculates the outlier bounds of every column of a 2D array at once, using the interquartile range (IQR) method.
+    NaN values are ignored.
+    :param values: A 2D float array, one column per feature.
+    :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+    :return: A (2, n_columns) array holding the lower bounds in the first row and the upper bounds in the second.
+    """
+    q1, q3 = np.nanquantile(values, [0.25, 0.75], axis=0)
+    iqr = q3 - q1
+    return np.stack([q1 - whisker_width * iqr, q3 + whisker_width * iqr])
+
+
+def treat_outliers_iqr(values: np.ndarray, whisker_width: float = 1.5,
+                       imputer=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Imputes, then caps, the outliers of every column of a 2D float array (in-place). This is the vectorized equivalent
+    of calling impute_outliers_iqr with a KNNImputer and then cap_outliers_iqr on each column: a single-column KNN
+    imputer has no other feature to measure distance with, so it fills every outlier with the mean of the inliers.
+    Pass a Fortran-ordered array for the best performance (and bit-identical results to the per-column functions).
+    :param values: A 2D float array, one column per feature.
+    :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+    :param imputer: An imputer object that will be fitted on the whole (masked) feature matrix, such as a
+    NeighborImputer, to impute outliers using all features. Defaults to None (column inlier means).
+    :return: The (2, n_columns) imputation bounds, the (n_columns,) imputed values and the (2, n_columns) capping bounds.
+    """
+    impute_bounds, impute_values = _impute_outliers(values, whisker_width, imputer)
+    cap_bounds = _cap_outliers(values, whisker_width)
+    return impute_bounds, impute_values, cap_bounds
+
+
+def _impute_outliers(values: np.ndarray, whisker_width: float, imputer) -> tuple[np.ndarray, np.ndarray]:
+    impute_bounds = iqr_bounds(values, whisker_width)
+    outliers = (values < impute_bounds[0]) | (values > impute_bounds[1])
+    values[outliers] = np.nan
+    impute_values = np.nanmean(values, axis=0)
+    if imputer is None:
+        np.copyto(values, impute_values, where=outliers)
+    else:
+        values[:] = imputer.fit_transform(values)
+    return impute_bounds, impute_values
+
+
+def _cap_outliers(values: np.ndarray, whisker_width: float) -> np.ndarray:
+    cap_bounds = iqr_bounds(values, whisker_width)
+    np.clip(values, cap_bounds[0], cap_bounds[1], out=values)
+    return cap_bounds
+
+
+def impute_outliers_iqr(col: str, df: pd.DataFrame, imputer, whisker_width: float = 1.5) -> tuple[float, float]:
     """
     Imputes outliers in the given column (in-place) using the interquartile range (IQR) method.
     :param col: Name of the column to impute outliers in.
     :param df: Pandas dataframe containing the column.
     :param imputer: An imputer object that will be used to impute the missing values.
     :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
-    :return: None
+    :return: The (lower, upper) bounds used for outlier detection.
     """
     # Calculate IQR
     q1 = df[col].quantile(0.25)
@@ -105,15 +383,16 @@ def impute_outliers_iqr(col: str, df: pd.DataFrame, imputer, whisker_width: floa
 
     # Use imputer
     df[[col]] = imputer.fit_transform(df[[col]])
+    return lower_bound, upper_bound
 
 
-def cap_outliers_iqr(col: str, df: pd.DataFrame, whisker_width: float = 1.5) -> None:
+def cap_outliers_iqr(col: str, df: pd.DataFrame, whisker_width: float = 1.5) -> tuple[float, float]:
     """
     Caps the outliers in a given column of a pandas DataFrame (in-place) using the interquartile range (IQR) method.
     :param col: A string representing the name of the column to cap outliers.
     :param df: A pandas DataFrame containing the data.
     :param whisker_width: A float representing the width of the whisker used in the IQR method. Default is 1.5.
-    :return: None
+    :return: The (lower, upper) bounds the column was capped to.
     """
     # Calculate IQR
     q1 = df[col].quantile(0.25)
@@ -125,3 +404,4 @@ def cap_outliers_iqr(col: str, df: pd.DataFrame, whisker_width: float = 1.5) ->
     # Cap outliers
     df[col] = np.where(df[col] < lower_bound, lower_bound, df[col])
     df[col] = np.where(df[col] > upper_bound, upper_bound, df[col])
+    return lower_bound, upper_bound
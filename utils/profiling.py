@@ -0,0 +1,122 @@
+import cProfile
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import pandas as pd
+
+
+class StageRecord:
+    """
+    The measurements of one pipeline stage.
+    """
+
+    def __init__(self, name: str, rows_in: int):
+        """
+        :param name: The name of the stage.
+        :param rows_in: The number of rows going into the stage.
+        """
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = rows_in
+        self.seconds = None
+        self.bytes_allocated = None  # Peak traced allocations, if allocations are traced
+        self.profile = None  # pstats.Stats, if cProfile is enabled
+
+    def to_dict(self) -> dict:
+        """
+        :return: The measurements (without the cProfile statistics), as a JSON serializable dict.
+        """
+        return {"stage": self.name, "seconds": self.seconds, "rows_in": self.rows_in, "rows_out": self.rows_out,
+                "bytes_allocated": self.bytes_allocated}
+
+
+class PipelineProfiler:
+    """
+    Opt-in instrumentation for the processing pipeline. Pass one to DataCSV or Preprocessor.fit_transform to record,
+    for every stage, its duration, its row counts in and out, and optionally its allocations (tracemalloc) and a
+    cProfile capture. Records are kept in `records` and also sent to each sink as soon as a stage ends, so they can be
+    forwarded to a logger or a metrics system.
+    """
+
+    def __init__(self, sinks: list[Callable[[StageRecord], None]] = None, trace_allocations: bool = False,
+                 cprofile: bool = False, enabled: bool = True):
+        """
+        :param sinks: Functions called with each StageRecord when its stage ends. Defaults to None (no sinks).
+        :param trace_allocations: Record the peak bytes allocated by each stage with tracemalloc. Slows the pipeline
+        down noticeably. Defaults to False.
+        :param cprofile: Capture a cProfile of each stage. Defaults to False.
+        :param enabled: Whether to record anything at all. A disabled profiler costs next to nothing. Defaults to True.
+        """
+        self.sinks = sinks if sinks is not None else []
+        self.trace_allocations = trace_allocations
+        self.cprofile = cprofile
+        self.enabled = enabled
+        self.records = []
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int) -> Iterator[StageRecord]:
+        """
+        Measures the stage run inside the with block. Set rows_out on the yielded record if the stage changes the number
+        of rows.
+        :param name: The name of the stage.
+        :param rows_in: The number of rows going into the stage.
+        :return: A context manager yielding the StageRecord.
+        """
+        record = StageRecord(name, rows_in)
+        if not self.enabled:
+            yield record
+            return
+
+        started_tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            allocated_before, _ = tracemalloc.get_traced_memory()
+        profile = cProfile.Profile() if self.cprofile else None
+        if profile is not None:
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                record.profile = pstats.Stats(profile)
+            if self.trace_allocations:
+                record.bytes_allocated = tracemalloc.get_traced_memory()[1] - allocated_before
+            if started_tracing:
+                tracemalloc.stop()
+
+        self.records.append(record)
+        for sink in self.sinks:
+            sink(record)
+
+    def report(self) -> pd.DataFrame:
+        """
+        :return: The records as a DataFrame, one row per stage, plus each stage's share of the total time.
+        """
+        report = pd.DataFrame([record.to_dict() for record in self.records],
+                              columns=["stage", "seconds", "rows_in", "rows_out", "bytes_allocated"])
+        report["share"] = report["seconds"] / report["seconds"].sum()
+        return report
+
+    def hottest(self) -> StageRecord:
+        """
+        :return: The record of the slowest stage.
+        """
+        return max(self.records, key=lambda record: record.seconds)
+
+
+def print_sink(record: StageRecord) -> None:
+    """
+    A sink printing one line per stage.
+    :param record: The StageRecord of the stage that just ended.
+    :return: None
+    """
+    allocated = f"{record.bytes_allocated / 2 ** 20:>10.2f}MB" if record.bytes_allocated is not None else ""
+    print(f"{record.name:20}{record.seconds * 1000:>10.2f}ms{record.rows_in:>10}{record.rows_out:>10}{allocated}")
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+
+from utils.statistics import QuantileSketch
+
+
+class QualityReport:
+    """
+    The data quality profile of a dataset: per column missing values, zeros, IQR outliers, minimum, quartiles and
+    maximum, plus the number of duplicate rows and duplicate IDs. Render it with to_frame, zero_report or to_text.
+    """
+
+    def __init__(self, columns: list[str], n_rows: int, missing: np.ndarray, zeros: np.ndarray, outliers: np.ndarray,
+                 quantiles: np.ndarray, duplicate_rows: int | None, duplicate_ids: int | None, exact: bool = True):
+        """
+        :param columns: The profiled columns.
+        :param n_rows: The number of rows.
+        :param missing: The number of missing values of each column.
+        :param zeros: The number of zeros of each column.
+        :param outliers: The number of IQR outliers of each column.
+        :param quantiles: The minimum, first quartile, median, third quartile and maximum of each column, as a 5 x
+        n_columns array.
+        :param duplicate_rows: The number of rows that repeat an earlier row, or None if duplicates were not counted.
+        :param duplicate_ids: The number of rows that repeat an earlier ID, or None if there is no ID column (or
+        duplicates were not counted).
+        :param exact: Whether the quartiles and outlier counts are exact, rather than estimated from quantile sketches.
+        Defaults to True.
+        """
+        self.columns = columns
+        self.n_rows = n_rows
+        self.missing = missing
+        self.zeros = zeros
+        self.outliers = outliers
+        self.quantiles = quantiles
+        self.duplicate_rows = duplicate_rows
+        self.duplicate_ids = duplicate_ids
+        self.exact = exact
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: The per column statistics, one row per column.
+        """
+        return pd.DataFrame({
+            "missing": self.missing,
+            "zeros": self.zeros,
+            "outliers": self.outliers,
+            "min": self.quantiles[0],
+            "25%": self.quantiles[1],
+            "50%": self.quantiles[2],
+            "75%": self.quantiles[3],
+            "max": self.quantiles[4],
+        }, index=pd.Index(self.columns, name="column"))
+
+    def zero_report(self) -> str:
+        """
+        :return: The number and percentage of zeros of each column, as a text table.
+        """
+        head = f"{'':10}{'Count':>10}{'Percentage':>15}\n{'-' * 35}\n"
+        rows = "".join(f"{col:10}{zeros:>10}{zeros / self.n_rows * 100 if self.n_rows else 0:>14.2f}%\n"
+                       for col, zeros in zip(self.columns, self.zeros))
+        return head + rows
+
+    def to_text(self) -> str:
+        """
+        :return: The whole profile, as a text report.
+        """
+        lines = [f"Rows: {self.n_rows}"]
+        if self.duplicate_rows is not None:
+            lines.append(f"Duplicate rows: {self.duplicate_rows}")
+        if self.duplicate_ids is not None:
+            lines.append(f"Duplicate IDs: {self.duplicate_ids}")
+        if not self.exact:
+            lines.append("Quartiles and outlier counts are estimated")
+        table = self.to_frame().to_string(float_format="{:.4f}".format)
+        return "\n".join(lines) + "\n\n" + table
+
+    def __str__(self) -> str:
+        return self.to_text()
+
+
+def profile_quality(df: pd.DataFrame, columns: list[str] = None, id_col: str | None = "ID",
+                    whisker_width: float = 1.5, duplicate_rows: bool = True,
+                    duplicate_ids: bool = True) -> QualityReport:
+    """
+    Profiles the data quality of a DataFrame, with one vectorized pass over its numeric columns as a NumPy block.
+    :param df: The DataFrame.
+    :param columns: The numeric columns to profile. Defaults to None (every numeric column but id_col).
+    :param id_col: The ID column duplicate IDs are counted on. Ignored if df has no such column. Defaults to "ID".
+    :param whisker_width: The multiplier of the IQR used to detect outliers. Defaults to 1.5.
+    :param duplicate_rows: Whether to count duplicate rows, the most expensive part of the profile, since every column
+    is hashed. Defaults to True.
+    :param duplicate_ids: Whether to count duplicate IDs (only id_col is hashed). Defaults to True.
+    :return: The QualityReport.
+    """
+    columns = _numeric_columns(df, columns, id_col)
+    values = df[columns].to_numpy(dtype=np.float64)
+    missing = np.isnan(values).sum(axis=0)
+    zeros = (values == 0).sum(axis=0)
+    quantiles = np.full((5, len(columns)), np.nan)
+    present = missing < len(values)
+    if present.any():
+        quantiles[:, present] = np.nanquantile(values[:, present], [0, 0.25, 0.5, 0.75, 1], axis=0)
+    lower, upper = _whiskers(quantiles, whisker_width)
+    outliers = ((values < lower) | (values > upper)).sum(axis=0)
+    n_duplicate_rows = int(df.duplicated().sum()) if duplicate_rows else None
+    n_duplicate_ids = int(df[id_col].duplicated().sum()) if duplicate_ids and id_col in df else None
+    return QualityReport(columns, len(df), missing, zeros, outliers, quantiles, n_duplicate_rows, n_duplicate_ids)
+
+
+class QualityProfiler:
+    """
+    Profiles the data quality of a dataset incrementally, chunk by chunk, in bounded memory (apart from one hash per
+    distinct row and ID, for the duplicate counts). Quartiles and outlier counts come from quantile sketches, so they
+    are exact until a column holds more than sketch_size values, and estimated after that. Profilers of different
+    chunks can be merged.
+    """
+
+    def __init__(self, columns: list[str] = None, id_col: str | None = "ID", whisker_width: float = 1.5,
+                 sketch_size: int = 4096):
+        """
+        :param columns: The numeric columns to profile. Defaults to None (every numeric column of the first chunk but
+        id_col).
+        :param id_col: The ID column duplicate IDs are counted on. Ignored if the chunks have no such column.
+        Defaults to "ID".
+        :param whisker_width: The multiplier of the IQR used to detect outliers. Defaults to 1.5.
+        :param sketch_size: The size of each column's QuantileSketch. Defaults to 4096.
+        """
+        self.columns = columns
+        self.id_col = id_col
+        self.whisker_width = whisker_width
+        self.sketch_size = sketch_size
+        self.n_rows = 0
+        self.n_ids = 0
+        self.row_hashes = set()
+        self.id_hashes = set()
+        self.missing = self.zeros = self.minimum = self.maximum = self.sketches = None
+
+    def update(self, chunk: pd.DataFrame) -> "QualityProfiler":
+        """
+        Adds a chunk of rows.
+        :param chunk: The chunk.
+        :return: The updated QualityProfiler itself.
+        """
+        if self.sketches is None:
+            self._start(_numeric_columns(chunk, self.columns, self.id_col))
+        values = chunk[self.columns].to_numpy(dtype=np.float64)
+        nan = np.isnan(values)
+        self.n_rows += len(chunk)
+        self.missing += nan.sum(axis=0)
+        self.zeros += (values == 0).sum(axis=0)
+        if len(values):
+            self.minimum = np.fmin(self.minimum, np.where(nan, np.inf, values).min(axis=0))
+            self.maximum = np.fmax(self.maximum, np.where(nan, -np.inf, values).max(axis=0))
+        for sketch, column in zip(self.sketches, values.T):
+            sketch.update(column)
+
+        self.row_hashes.update(pd.util.hash_pandas_object(chunk, index=False).tolist())
+        if self.id_col in chunk:
+            self.n_ids += len(chunk)
+            self.id_hashes.update(pd.util.hash_pandas_object(chunk[self.id_col], index=False).tolist())
+        return self
+
+    def merge(self, other: "QualityProfiler") -> "QualityProfiler":
+        """
+        Combines the profile of another QualityProfiler, over the same columns (in-place).
+        :param other: The profiler to merge into this one.
+        :return: The updated QualityProfiler itself.
+        """
+        if other.sketches is None:
+            return self
+        if self.sketches is None:
+            self._start(other.columns)
+        self.n_rows += other.n_rows
+        self.n_ids += other.n_ids
+        self.row_hashes |= other.row_hashes
+        self.id_hashes |= other.id_hashes
+        self.missing += other.missing
+        self.zeros += other.zeros
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    def report(self) -> QualityReport:
+        """
+        :return: The QualityReport of every chunk added so far.
+        """
+        if self.sketches is None:
+            self._start(self.columns if self.columns is not None else [])
+        quantiles = np.full((5, len(self.columns)), np.nan)
+        outliers = np.zeros(len(self.columns), dtype=np.int64)
+        for j, sketch in enumerate(self.sketches):
+            if sketch.count == 0:
+                continue
+            items, weights = sketch.weighted_items()
+            quantiles[1:4, j] = sketch.quantile([0.25, 0.5, 0.75])
+            lower, upper = _whiskers(quantiles[:, j], self.whisker_width)
+            outliers[j] = weights[(items < lower) | (items > upper)].sum()
+        empty = self.missing == self.n_rows
+        quantiles[0] = np.where(empty, np.nan, self.minimum)
+        quantiles[4] = np.where(empty, np.nan, self.maximum)
+        duplicate_ids = self.n_ids - len(self.id_hashes) if self.n_ids else None
+        return QualityReport(self.columns, self.n_rows, self.missing.copy(), self.zeros.copy(), outliers, quantiles,
+                             self.n_rows - len(self.row_hashes), duplicate_ids,
+                             exact=all(sketch.exact for sketch in self.sketches))
+
+    def _start(self, columns: list[str]) -> None:
+        self.columns = columns
+        self.missing = np.zeros(len(columns), dtype=np.int64)
+        self.zeros = np.zeros(len(columns), dtype=np.int64)
+        self.minimum = np.full(len(columns), np.inf)
+        self.maximum = np.full(len(columns), -np.inf)
+        self.sketches = [QuantileSketch(self.sketch_size) for _ in columns]
+
+
+def _numeric_columns(df: pd.DataFrame, columns: list[str] | None, id_col: str | None) -> list[str]:
+    if columns is not None:
+        return list(columns)
+    return [col for col in df.select_dtypes(include="number").columns if col != id_col]
+
+
+def _whiskers(quantiles: np.ndarray, whisker_width: float) -> tuple[np.ndarray, np.ndarray]:
+    iqr = quantiles[3] - quantiles[1]
+    return quantiles[1] - whisker_width * iqr, quantiles[3] + whisker_width * iqr
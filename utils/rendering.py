@@ -0,0 +1,86 @@
+import json
+import os
+
+import joblib
+from joblib import Parallel, delayed
+
+
+class PlotJob:
+    """
+    One figure to render: a plotting function of utils.visualization, its arguments, and the file to save it to.
+    Jobs are pickled to the rendering processes, so their arguments must be picklable.
+    """
+
+    def __init__(self, function: str, save_path: str, args: tuple = (), kwargs: dict = None, save_dpi: int = 300):
+        """
+        :param function: The name of the plotting function, e.g. "show_boxplots".
+        :param save_path: The file to save the figure to.
+        :param args: The positional arguments of the plotting function. Defaults to ().
+        :param kwargs: The keyword arguments of the plotting function, other than save_path and save_dpi.
+        Defaults to None (no keyword arguments).
+        :param save_dpi: The DPI of the saved figure. Defaults to 300.
+        """
+        self.function = function
+        self.save_path = save_path
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.save_dpi = save_dpi
+
+    def fingerprint(self) -> str:
+        """
+        :return: A hash of the function name, its arguments (including the data) and the DPI.
+        """
+        return joblib.hash((self.function, self.args, self.kwargs, self.save_dpi))
+
+
+def render_jobs(jobs: list[PlotJob], n_jobs: int = -1, manifest_path: str = "../images/.render_manifest.json",
+                force: bool = False) -> list[str]:
+    """
+    Renders figures headless, on the Agg backend, in a process pool. The fingerprint of every rendered job is kept in a
+    manifest, and a job is skipped if its file exists and its fingerprint is unchanged since it was last rendered.
+    :param jobs: The figures to render.
+    :param n_jobs: The number of rendering processes. Defaults to -1 (one per CPU).
+    :param manifest_path: The file to keep the fingerprints in. Defaults to "../images/.render_manifest.json".
+    :param force: Render every job, even the unchanged ones. Defaults to False.
+    :return: The files that were (re-)rendered.
+    """
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    fingerprints = {job.save_path: job.fingerprint() for job in jobs}
+    stale = [
+        job for job in jobs
+        if force or not os.path.exists(job.save_path) or manifest.get(job.save_path) != fingerprints[job.save_path]
+    ]
+    if stale:
+        Parallel(n_jobs=min(n_jobs, len(stale)) if n_jobs > 0 else n_jobs)(
+            delayed(_render)(job, os.getpid()) for job in stale
+        )
+
+    manifest.update({job.save_path: fingerprints[job.save_path] for job in stale})
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return [job.save_path for job in stale]
+
+
+def _render(job: PlotJob, caller_pid: int) -> None:
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from utils import visualization
+
+    if os.getpid() != caller_pid:
+        matplotlib.use("Agg", force=True)
+    # joblib runs a lone job in the calling process (e.g. a notebook), where switching the backend would close every
+    # open figure: only headless mode is switched on there, and it is restored afterwards
+    headless, figures = visualization._headless, set(plt.get_fignums())
+    visualization.set_headless(True)
+    try:
+        getattr(visualization, job.function)(*job.args, save_path=job.save_path, save_dpi=job.save_dpi, **job.kwargs)
+    finally:
+        for number in set(plt.get_fignums()) - figures:
+            plt.close(number)
+        visualization.set_headless(headless)
@@ -0,0 +1,366 @@
+import hashlib
+import os
+import time
+import warnings
+
+import joblib
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.exceptions import FitFailedWarning
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+
+class CachedGridSearchCV:
+    """
+    A drop-in alternative to GridSearchCV. The fold splits are computed once, the data is memory mapped into a process
+    pool, and the scores of each (estimator, params, fold) fit are cached on disk, so an interrupted or extended grid
+    resumes where it left off. The results have the same shape as GridSearchCV's (cv_results_, best_index_, ...), so
+    they can be passed straight to visualize_training.
+    """
+
+    def __init__(self, estimator, param_grid: dict | list[dict], cv=None, scoring: list[str] = ("f1", "roc_auc"),
+                 refit: str = "f1", return_train_score: bool = True, n_jobs: int = None, cache_dir: str = None,
+                 error_score: float | str = np.nan):
+        """
+        :param estimator: The estimator to tune.
+        :param param_grid: The hyperparameter grid, as for GridSearchCV.
+        :param cv: The cross-validation splitter, or number of folds, as for GridSearchCV. Defaults to None (5 folds).
+        :param scoring: The names of the scorers to evaluate. Defaults to ("f1", "roc_auc").
+        :param refit: The scorer used to pick (and refit) the best parameters. Defaults to "f1".
+        :param return_train_score: Whether to also score the training folds. Defaults to True.
+        :param n_jobs: The number of worker processes, as for joblib. Defaults to None (serial).
+        :param cache_dir: The directory to cache fold results and memory mapped data in. Defaults to None (no caching).
+        :param error_score: The score given to a fold whose fit or scoring fails, with a FitFailedWarning, or "raise" to
+        raise the error, as for GridSearchCV. Failed folds are not cached, so they are retried on the next run.
+        Defaults to np.nan (ranked last).
+        """
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.refit = refit
+        self.return_train_score = return_train_score
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
+        self.error_score = error_score
+
+    def fit(self, X: np.ndarray, y: np.ndarray, sample_weight: np.ndarray = None) -> "CachedGridSearchCV":
+        """
+        Runs the search, then refits the best candidate on the whole of X.
+        :param X: The training features.
+        :param y: The training target.
+        :param sample_weight: Per row weights (such as DataCSV.sample_weight), used to fit every candidate and to weight
+        every score. Defaults to None (unweighted).
+        :return: The fitted CachedGridSearchCV itself.
+        """
+        X, y, folds = self._prepare(X, y, sample_weight)
+        candidates = list(ParameterGrid(self.param_grid))
+        scores = self._evaluate(X, y, folds, [(candidate, None) for candidate in candidates])
+        self.cv_results_ = _cv_results(candidates, scores, self.scoring, self.return_train_score)
+        return self._refit(X, y)
+
+    def _prepare(self, X: np.ndarray, y: np.ndarray,
+                 sample_weight: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, list]:
+        X = np.asarray(X)
+        # float32 features (see FeatureMatrix) are kept as they are rather than copied to float64
+        X = np.ascontiguousarray(X, dtype=X.dtype if X.dtype in (np.float32, np.float64) else np.float64)
+        y = np.asarray(y).ravel()
+        self.sample_weight_ = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float64).ravel()
+        folds = list(check_cv(self.cv, y, classifier=True).split(X, y))
+        self.n_splits_ = len(folds)
+        # Without a cache_dir, joblib still memory maps large arrays into the worker processes by itself
+        if self.cache_dir is not None:
+            weights = [] if self.sample_weight_ is None else [self.sample_weight_]
+            self._fingerprint = _fingerprint(X, y, folds, *weights)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            X = _memmap(X, os.path.join(self.cache_dir, f"X-{self._fingerprint}.npy"))
+        return X, y, folds
+
+    def _evaluate(self, X: np.ndarray, y: np.ndarray, folds: list,
+                  jobs: list[tuple[dict, int | None]]) -> list[list[dict]]:
+        # Scores every (params, n_samples) job on every fold, loading what it can from the cache. n_samples limits the
+        # training part of each fold to a random subset of that size (None uses all of it).
+        tasks = [(job, fold) for job in range(len(jobs)) for fold in range(len(folds))]
+        scores, paths = dict.fromkeys(tasks), dict.fromkeys(tasks)
+        if self.cache_dir is not None:
+            for job, fold in tasks:
+                params, n_samples = jobs[job]
+                key = _task_key(self.estimator, params, self._fingerprint, fold, n_samples, self.scoring,
+                                self.return_train_score)
+                paths[(job, fold)] = os.path.join(self.cache_dir, key + ".joblib")
+                if os.path.exists(paths[(job, fold)]):
+                    scores[(job, fold)] = joblib.load(paths[(job, fold)])
+
+        todo = [task for task in tasks if scores[task] is None]
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_and_score)(
+                self.estimator, jobs[job][0], X, y, _subsample(folds[fold][0], y, jobs[job][1], fold), folds[fold][1],
+                self.scoring, self.return_train_score, paths[(job, fold)], self.sample_weight_, self.error_score
+            )
+            for job, fold in todo
+        )
+        scores.update(zip(todo, results))
+        return [[scores[(job, fold)] for fold in range(len(folds))] for job in range(len(jobs))]
+
+    def _refit(self, X: np.ndarray, y: np.ndarray):
+        self.best_index_ = int(np.argmin(self.cv_results_[f"rank_test_{self.refit}"]))
+        self.best_params_ = self.cv_results_["params"][self.best_index_]
+        self.best_score_ = self.cv_results_[f"mean_test_{self.refit}"][self.best_index_]
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(
+            X, y, **_weights(self.sample_weight_, slice(None))
+        )
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predicts with the best estimator.
+        :param X: The features.
+        :return: The predicted classes.
+        """
+        return self.best_estimator_.predict(X)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predicts class probabilities with the best estimator.
+        :param X: The features.
+        :return: The predicted class probabilities.
+        """
+        return self.best_estimator_.predict_proba(X)
+
+
+class SuccessiveHalvingSearchCV(CachedGridSearchCV):
+    """
+    A successive halving version of CachedGridSearchCV. Every candidate is first evaluated with a small budget
+    (training samples or n_estimators); only the best 1 / factor of them, by their mean refit score, move on to the next
+    iteration, which has factor times the budget. Only the last few candidates are trained with the full budget. The
+    results have the same shape as GridSearchCV's, with one row per candidate per iteration and two extra keys, "iter"
+    and "n_resources", so they can be passed straight to visualize_training.
+    """
+
+    def __init__(self, estimator, param_grid: dict | list[dict], cv=None, scoring: list[str] = ("f1", "roc_auc"),
+                 refit: str = "f1", return_train_score: bool = True, n_jobs: int = None, cache_dir: str = None,
+                 resource: str = "n_samples", factor: int = 3, min_resources: int = None, max_resources: int = None,
+                 error_score: float | str = np.nan):
+        """
+        :param estimator: The estimator to tune.
+        :param param_grid: The hyperparameter grid, as for GridSearchCV.
+        :param cv: The cross-validation splitter, or number of folds, as for GridSearchCV. Defaults to None (5 folds).
+        :param scoring: The names of the scorers to evaluate. Defaults to ("f1", "roc_auc").
+        :param refit: The scorer used to drop candidates, pick (and refit) the best parameters. Defaults to "f1".
+        :param return_train_score: Whether to also score the training folds. Defaults to True.
+        :param n_jobs: The number of worker processes, as for joblib. Defaults to None (serial).
+        :param cache_dir: The directory to cache fold results and memory mapped data in. Defaults to None (no caching).
+        :param resource: The budget to grow: "n_samples" (training samples per fold) or the name of an estimator
+        parameter such as "n_estimators". Defaults to "n_samples".
+        :param factor: The rate at which candidates are dropped and the budget grows. Defaults to 3.
+        :param min_resources: The budget of the first iteration. Defaults to None (chosen so the last iteration uses
+        max_resources).
+        :param max_resources: The budget of the last iteration. Defaults to None, which is the size of the smallest
+        training fold for "n_samples", and is required for any other resource.
+        :param error_score: The score given to a fold whose fit or scoring fails, or "raise", as for CachedGridSearchCV.
+        Defaults to np.nan (ranked last, so the candidate is dropped).
+        """
+        super().__init__(estimator, param_grid, cv, scoring, refit, return_train_score, n_jobs, cache_dir, error_score)
+        self.resource = resource
+        self.factor = factor
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+
+    def fit(self, X: np.ndarray, y: np.ndarray, sample_weight: np.ndarray = None) -> "SuccessiveHalvingSearchCV":
+        """
+        Runs the search, then refits the best candidate of the last iteration on the whole of X.
+        :param X: The training features.
+        :param y: The training target.
+        :param sample_weight: Per row weights (such as DataCSV.sample_weight), used to fit every candidate and to weight
+        every score. Defaults to None (unweighted).
+        :return: The fitted SuccessiveHalvingSearchCV itself.
+        """
+        X, y, folds = self._prepare(X, y, sample_weight)
+        candidates = list(ParameterGrid(self.param_grid))
+        by_samples = self.resource == "n_samples"
+        if not by_samples and any(self.resource in candidate for candidate in candidates):
+            raise ValueError(f"{self.resource} is the resource, so it cannot be part of the parameter grid.")
+        if not by_samples and self.max_resources is None:
+            raise ValueError(f"max_resources is required when the resource is {self.resource}.")
+
+        max_resources = self.max_resources or min(len(train) for train, _ in folds)
+        n_iterations = 1 + int(np.floor(np.log(len(candidates)) / np.log(self.factor)))
+        min_resources = self.min_resources or max(max_resources // self.factor ** (n_iterations - 1), 1)
+
+        rows, scores, iterations, n_resources = [], [], [], []
+        for iteration in range(n_iterations):
+            budget = min(min_resources * self.factor ** iteration, max_resources)
+            if by_samples:
+                jobs = [(candidate, budget) for candidate in candidates]
+            else:
+                jobs = [({**candidate, self.resource: budget}, None) for candidate in candidates]
+            iteration_scores = self._evaluate(X, y, folds, jobs)
+
+            rows += [params for params, _ in jobs]
+            scores += iteration_scores
+            iterations += [iteration] * len(jobs)
+            n_resources += [budget] * len(jobs)
+
+            # Drop the worst candidates. The search stops early once a single candidate is left.
+            means = np.array([np.mean([fold[f"test_{self.refit}"] for fold in candidate_scores])
+                              for candidate_scores in iteration_scores])
+            n_kept = int(np.ceil(len(candidates) / self.factor))
+            candidates = [candidates[i] for i in np.argsort(-np.nan_to_num(means, nan=-np.inf), kind="stable")[:n_kept]]
+            if len(jobs) == 1 or budget == max_resources:
+                break
+
+        self.n_iterations_ = len(set(iterations))
+        self.cv_results_ = _cv_results(rows, scores, self.scoring, self.return_train_score, np.array(iterations))
+        self.cv_results_["iter"] = np.array(iterations)
+        self.cv_results_["n_resources"] = np.array(n_resources)
+        return self._refit(X, y)
+
+
+def polynomial_features(train_X: np.ndarray, val_X: np.ndarray, degree: int,
+                        cache_dir: str = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Expands train_X and val_X into polynomial features and standardizes them with the statistics of train_X. With a
+    cache_dir, the expansion is computed once and memory mapped from disk afterwards, so every model (and every worker
+    process) sharing it reads the same copy.
+    :param train_X: The training features.
+    :param val_X: The validation features.
+    :param degree: The degree of the polynomial features.
+    :param cache_dir: The directory to cache the expansion in. Defaults to None (no caching).
+    :return: The expanded training and validation features.
+    """
+    train_X = np.ascontiguousarray(train_X, dtype=np.float64)
+    val_X = np.ascontiguousarray(val_X, dtype=np.float64)
+    if cache_dir is not None:
+        key = _fingerprint(train_X, val_X, [degree])
+        paths = [os.path.join(cache_dir, f"poly{degree}-{part}-{key}.npy") for part in ("train", "val")]
+        if all(os.path.exists(path) for path in paths):
+            return tuple(np.load(path, mmap_mode="r") for path in paths)
+
+    poly = PolynomialFeatures(degree)
+    scaler = StandardScaler()
+    train_X_poly = scaler.fit_transform(poly.fit_transform(train_X))
+    val_X_poly = scaler.transform(poly.transform(val_X))
+    if cache_dir is None:
+        return train_X_poly, val_X_poly
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return _memmap(train_X_poly, paths[0]), _memmap(val_X_poly, paths[1])
+
+
+def _fit_and_score(estimator, params: dict, X: np.ndarray, y: np.ndarray, train: np.ndarray, test: np.ndarray,
+                   scoring: list[str], return_train_score: bool, cache_path: str = None,
+                   sample_weight: np.ndarray = None, error_score: float | str = np.nan) -> dict:
+    start = time.perf_counter()
+    result = {"fit_time": 0.0, "score_time": 0.0}
+    try:
+        estimator = clone(estimator).set_params(**params).fit(X[train], y[train], **_weights(sample_weight, train))
+        result["fit_time"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name in scoring:
+            scorer = get_scorer(name)
+            result[f"test_{name}"] = scorer(estimator, X[test], y[test], **_weights(sample_weight, test))
+            if return_train_score:
+                result[f"train_{name}"] = scorer(estimator, X[train], y[train], **_weights(sample_weight, train))
+        result["score_time"] = time.perf_counter() - start
+    except Exception as error:
+        if error_score == "raise":
+            raise
+        warnings.warn(f"Fitting or scoring {params} failed, its scores are set to {error_score}: {error!r}",
+                      FitFailedWarning)
+        for name in scoring:
+            for split in ("test", "train") if return_train_score else ("test",):
+                result[f"{split}_{name}"] = error_score
+        # Not cached: the failure may be transient (e.g. out of memory) and error_score is not part of the key
+        return result
+
+    if cache_path is not None:
+        joblib.dump(result, cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    return result
+
+
+def _cv_results(candidates: list[dict], scores: list[list[dict]], scoring: list[str], return_train_score: bool,
+                iterations: np.ndarray = None) -> dict:
+    results = {"params": candidates}
+    for name in {name for candidate in candidates for name in candidate}:
+        results[f"param_{name}"] = np.ma.masked_array(
+            [candidate.get(name) for candidate in candidates],
+            mask=[name not in candidate for candidate in candidates], dtype=object
+        )
+
+    def collect(key: str) -> np.ndarray:
+        return np.array([[fold_scores[key] for fold_scores in candidate_scores] for candidate_scores in scores])
+
+    for key in ("fit_time", "score_time"):
+        values = collect(key)
+        results[f"mean_{key}"], results[f"std_{key}"] = values.mean(axis=1), values.std(axis=1)
+
+    for name in scoring:
+        for split in ("test", "train") if return_train_score else ("test",):
+            values = collect(f"{split}_{name}")
+            for fold in range(values.shape[1]):
+                results[f"split{fold}_{split}_{name}"] = values[:, fold]
+            results[f"mean_{split}_{name}"] = values.mean(axis=1)
+            results[f"std_{split}_{name}"] = values.std(axis=1)
+        # Same ranking as GridSearchCV: ties share the lowest rank, NaN scores rank last. Candidates that made it to a
+        # later iteration (successive halving) always rank before the ones that were dropped earlier.
+        means = np.nan_to_num(results[f"mean_test_{name}"], nan=-np.inf)
+        iters = iterations if iterations is not None else np.zeros(len(means))
+        same_iter = iters[None, :] == iters[:, None]
+        better = (iters[None, :] > iters[:, None]) | (same_iter & (means[None, :] > means[:, None]))
+        results[f"rank_test_{name}"] = better.sum(axis=1) + 1
+    return results
+
+
+def _fingerprint(*arrays) -> str:
+    digest = hashlib.sha256()
+    for array in arrays:
+        for part in array if isinstance(array, list) else [array]:
+            for item in part if isinstance(part, tuple) else [part]:
+                item = np.ascontiguousarray(item)
+                digest.update(str((item.dtype, item.shape)).encode())
+                digest.update(item.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _task_key(estimator, params: dict, fingerprint: str, fold: int, n_samples: int | None, scoring: list[str],
+              return_train_score: bool) -> str:
+    # return_train_score is part of the key, since entries written without it hold no train scores. Budgets are marked
+    # as stratified, so results of the earlier unstratified subsamples are not reused.
+    budget = None if n_samples is None else ("stratified", n_samples)
+    description = repr((type(estimator).__qualname__, sorted(clone(estimator).get_params(deep=False).items(), key=str),
+                        sorted(params.items()), fingerprint, fold, budget, list(scoring), return_train_score))
+    return hashlib.sha256(description.encode()).hexdigest()[:24]
+
+
+def _weights(sample_weight: np.ndarray | None, rows) -> dict:
+    # Only pass sample_weight on when there is one, so estimators without support for it keep working unweighted
+    return {} if sample_weight is None else {"sample_weight": sample_weight[rows]}
+
+
+def _subsample(train: np.ndarray, y: np.ndarray, n_samples: int | None, seed: int) -> np.ndarray:
+    # Stratified: each class keeps its share of the fold (largest remainders), and at least one row, so a small budget
+    # never leaves a single class to fit on
+    if n_samples is None or n_samples >= len(train):
+        return train
+    _, inverse, counts = np.unique(y[train], return_inverse=True, return_counts=True)
+    quotas = n_samples * counts / len(train)
+    sizes = np.floor(quotas).astype(np.int64)
+    sizes[np.argsort(sizes - quotas, kind="stable")[:n_samples - sizes.sum()]] += 1
+    sizes = np.maximum(sizes, 1)
+    while sizes.sum() > max(n_samples, len(sizes)):
+        sizes[np.argmax(sizes)] -= 1
+    rng = np.random.default_rng(seed)
+    rows = [rng.permutation(np.flatnonzero(inverse == k))[:size] for k, size in enumerate(sizes)]
+    return np.sort(train[np.concatenate(rows)])
+
+
+def _memmap(values: np.ndarray, path: str) -> np.ndarray:
+    if not os.path.exists(path):
+        np.save(path + ".tmp.npy", values)
+        os.replace(path + ".tmp.npy", path)
+    return np.load(path, mmap_mode="r")
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from utils.processing import FEATURE_COLS, Preprocessor
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into micro-batches. A batch is sent to predict_fn as soon as it holds
+    max_batch_size rows, or max_wait_ms after its first request arrived, whichever comes first. predict_fn runs in a
+    worker thread, so the event loop keeps accepting (and batching) requests in the meantime.
+    """
+
+    def __init__(self, predict_fn, max_batch_size: int = 256, max_wait_ms: float = 5.0):
+        """
+        :param predict_fn: A function mapping a 2D array of rows to an array with one result per row.
+        :param max_batch_size: The maximum number of rows per batch. Defaults to 256.
+        :param max_wait_ms: The maximum time a request waits for a batch to fill up, in milliseconds. Defaults to 5.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self) -> None:
+        """
+        Starts the batching loop. Must be called from a running event loop.
+        :return: None
+        """
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the batching loop.
+        :return: None
+        """
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Queues rows for scoring and waits for their results.
+        :param rows: A 2D array of rows.
+        :return: The results for these rows.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while n_rows < self.max_batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                n_rows += len(batch[-1][0])
+
+            try:
+                results = await loop.run_in_executor(None, self.predict_fn, np.concatenate([rows for rows, _ in batch]))
+            except Exception as error:
+                if len(batch) == 1:
+                    _settle(batch[0][1], error=error)
+                    continue
+                # Score each request on its own, so an error only reaches the request that caused it
+                for rows, future in batch:
+                    try:
+                        _settle(future, await loop.run_in_executor(None, self.predict_fn, rows))
+                    except Exception as request_error:
+                        _settle(future, error=request_error)
+                continue
+
+            offsets = np.cumsum([len(rows) for rows, _ in batch])[:-1]
+            for (_, future), future_results in zip(batch, np.split(results, offsets)):
+                _settle(future, future_results)
+
+
+def _settle(future: asyncio.Future, result: np.ndarray = None, error: Exception = None) -> None:
+    # The client may have gone away (cancelling its future) while its batch was being scored
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ScoringService:
+    """
+    Scores patients with a persisted Preprocessor and a persisted (joblib) model, such as a fitted GridSearchCV.
+    """
+
+    def __init__(self, preprocessor_path: str, model_path: str, clean: bool = True):
+        """
+        :param preprocessor_path: The file the fitted Preprocessor was saved to.
+        :param model_path: The file the fitted model was saved to with joblib.
+        :param clean: Also replace zeros and treat outliers before scoring (see Preprocessor.transform).
+        Defaults to True.
+        """
+        self.preprocessor = Preprocessor.load(preprocessor_path)
+        self.model = joblib.load(model_path)
+        self.clean = clean
+
+    def predict(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Scores raw patient rows in one vectorized call.
+        :param rows: A 2D float array with the FEATURE_COLS columns, in order.
+        :return: The probability of sepsis of each row.
+        """
+        features = self.preprocessor.transform_values(rows, self.clean)
+        if hasattr(self.model, "feature_names_in_"):
+            features = pd.DataFrame(features, columns=FEATURE_COLS)
+        return self.model.predict_proba(features)[:, 1]
+
+
+def parse_records(payload) -> np.ndarray:
+    """
+    Converts patient records (dicts with the Paitients_Files schema) into a feature array. Other fields, such as ID and
+    Insurance, are ignored.
+    :param payload: A single record, or a list of records.
+    :return: A 2D float array with the FEATURE_COLS columns, in order.
+    :raises ValueError: If a value is not finite (NaN or infinity, which JSON parsing and float() both accept).
+    """
+    records = payload if isinstance(payload, list) else [payload]
+    rows = np.array([[float(record[col]) for col in FEATURE_COLS] for record in records], dtype=np.float64).reshape(
+        len(records), len(FEATURE_COLS)
+    )
+    if not np.isfinite(rows).all():
+        row, col = np.argwhere(~np.isfinite(rows))[0]
+        raise ValueError(f"Record {row} has a non-finite {FEATURE_COLS[col]}: {rows[row, col]}")
+    return rows
+
+
+async def handle_connection(batcher: MicroBatcher, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Serves HTTP/1.1 requests on a connection (kept alive until the client closes it):
+    POST /predict with a JSON record or list of records, and GET /health.
+    :param batcher: The MicroBatcher to score records with.
+    :param reader: The connection reader.
+    :param writer: The connection writer.
+    :return: None
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "GET" and path == "/health":
+                status, response = 200, {"status": "ok"}
+            elif method == "POST" and path == "/predict":
+                try:
+                    payload = json.loads(body)
+                    records = payload if isinstance(payload, list) else [payload]
+                    probabilities = await batcher.submit(parse_records(payload))
+                    status, response = 200, [
+                        {"ID": record.get("ID"), "Sepssis": "Positive" if probability >= 0.5 else "Negative",
+                         "probability": float(probability)}
+                        for record, probability in zip(records, probabilities)
+                    ]
+                except (ValueError, KeyError, TypeError, AttributeError) as error:
+                    status, response = 400, {"error": f"Invalid records: {error!r}"}
+            else:
+                status, response = 404, {"error": "Not found"}
+
+            data = json.dumps(response).encode()
+            writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service: ScoringService, host: str = "127.0.0.1", port: int = 8000, unix_path: str = None,
+                max_batch_size: int = 256, max_wait_ms: float = 5.0) -> None:
+    """
+    Runs the scoring server until cancelled.
+    :param service: The ScoringService to score records with.
+    :param host: The host to listen on. Defaults to "127.0.0.1".
+    :param port: The port to listen on. Defaults to 8000.
+    :param unix_path: Listen on this Unix socket instead of host:port. Defaults to None.
+    :param max_batch_size: The maximum number of rows per batch. Defaults to 256.
+    :param max_wait_ms: The maximum time a request waits for a batch to fill up, in milliseconds. Defaults to 5.
+    :return: None
+    """
+    batcher = MicroBatcher(service.predict, max_batch_size, max_wait_ms)
+    batcher.start()
+
+    async def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await handle_connection(batcher, reader, writer)
+
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(handler, unix_path)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local micro-batching sepsis scoring server.")
+    parser.add_argument("--preprocessor", required=True, help="The file the fitted Preprocessor was saved to.")
+    parser.add_argument("--model", required=True, help="The file the fitted model was saved to with joblib.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="Listen on this Unix socket instead of host:port.")
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--no-clean", dest="clean", action="store_false",
+                        help="Skip replacing zeros and treating outliers before scoring, for already clean input.")
+    args = parser.parse_args()
+
+    asyncio.run(serve(ScoringService(args.preprocessor, args.model, args.clean), args.host, args.port,
+                      args.unix_socket, args.max_batch_size, args.max_wait_ms))
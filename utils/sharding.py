@@ -0,0 +1,218 @@
+import argparse
+import os
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from utils.processing import FEATURE_COLS, Preprocessor
+from utils.statistics import RunningMoments
+from utils.streaming import TrainingStatistics, _fitted_scaler, read_csv_chunks, transform_streaming
+
+
+def shard_statistics(path: str, chunk_size: int = 100_000, sketch_size: int = 4096,
+                     exclude: np.ndarray = None) -> tuple[TrainingStatistics, np.ndarray]:
+    """
+    The first round of the sharded fit, run by the worker of one shard: the mergeable TrainingStatistics of the shard's
+    distinct rows (sums and zero counts for the means, quantile sketches for the IQR bounds), and the hashes of those
+    rows, so the coordinator can find the rows shared with other shards.
+    :param path: The path to the shard's training CSV file.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :param exclude: The hashes of rows to leave out, because an earlier shard holds them. Defaults to None.
+    :return: The statistics, and the hashes of the rows they summarize.
+    """
+    stats = TrainingStatistics(sketch_size)
+    seen = _seen(exclude)
+    for chunk in read_csv_chunks(path, chunk_size, seen=seen):
+        stats.update(chunk)
+    if exclude is not None:
+        seen.difference_update(exclude.tolist())
+    return stats, np.fromiter(seen, dtype=np.uint64, count=len(seen))
+
+
+def shard_moments(preprocessor: Preprocessor, path: str, chunk_size: int = 100_000,
+                  exclude: np.ndarray = None) -> RunningMoments:
+    """
+    The second round of the sharded fit, run by the worker of one shard: the mergeable moments of the shard's cleaned
+    and log transformed features, from which the coordinator fits the scaler exactly.
+    :param preprocessor: The Preprocessor derived from the merged statistics of the first round.
+    :param path: The path to the shard's training CSV file.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param exclude: The hashes of rows to leave out, because an earlier shard holds them. Defaults to None.
+    :return: The moments.
+    """
+    moments = RunningMoments(len(FEATURE_COLS))
+    for chunk in read_csv_chunks(path, chunk_size, seen=_seen(exclude)):
+        if chunk.empty:
+            continue
+        values = chunk[FEATURE_COLS].to_numpy(dtype=np.float64, copy=True)
+        moments.update(preprocessor._log(preprocessor._clean(values)))
+    return moments
+
+
+def cross_shard_duplicates(hashes: list[np.ndarray]) -> list[np.ndarray]:
+    """
+    Finds the rows held by more than one shard. A row belongs to the first shard that holds it, so the single-process
+    pipeline, which keeps the first occurrence of each row of the concatenated shards, is reproduced.
+    :param hashes: The distinct row hashes of each shard, in shard order.
+    :return: For each shard, the hashes of its rows that an earlier shard holds.
+    """
+    shard = np.repeat(np.arange(len(hashes)), [len(h) for h in hashes])
+    all_hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+    first = np.zeros(len(all_hashes), dtype=bool)
+    first[np.unique(all_hashes, return_index=True)[1]] = True
+    return [all_hashes[~first & (shard == i)] for i in range(len(hashes))]
+
+
+def fit_sharded(train_data_paths: list[str], n_jobs: int = -1, chunk_size: int = 100_000, sketch_size: int = 4096,
+                whisker_width: float = 1.5, added_const: float = 0.001, exact_scaler: bool = True) -> Preprocessor:
+    """
+    Fits a Preprocessor on training data partitioned into several CSV files (e.g. one per hospital), with one worker
+    process per shard. The result matches Preprocessor.fit on the concatenated, de-duplicated files: the means and the
+    scaler exactly, the IQR bounds within the sketch error (exactly while each column holds fewer than sketch_size
+    values).
+    :param train_data_paths: The paths to the training CSV files, one per shard.
+    :param n_jobs: The number of worker processes, as for joblib. Defaults to -1 (all CPUs).
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+    :param added_const: The constant added to non-zero values before taking their log. Defaults to 0.001.
+    :param exact_scaler: Fit the scaler from the exact moments of the cleaned data, at the cost of a second pass over
+    the shards. Otherwise, estimate it from the sketches, as fit_streaming does. Defaults to True.
+    :return: The fitted Preprocessor.
+    """
+    return _fit_sharded(train_data_paths, n_jobs, chunk_size, sketch_size, whisker_width, added_const,
+                        exact_scaler)[0]
+
+
+def transform_sharded(preprocessor: Preprocessor, data_paths: list[str], out_paths: list[str], n_jobs: int = -1,
+                      chunk_size: int = 100_000, clean: bool = True, drop_duplicates: bool = False,
+                      exclude: list[np.ndarray] = None) -> list[int]:
+    """
+    Transforms several CSV files in parallel with a fitted Preprocessor, one worker process per file.
+    :param preprocessor: The fitted Preprocessor.
+    :param data_paths: The paths to the dataset files to transform.
+    :param out_paths: The path of the CSV file to write for each input file.
+    :param n_jobs: The number of worker processes, as for joblib. Defaults to -1 (all CPUs).
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param clean: Also replace zeros and treat outliers (see Preprocessor.transform). Defaults to True.
+    :param drop_duplicates: Drop rows duplicated within a file, like the training data cleaning does. Defaults to False.
+    :param exclude: For each file, the hashes of rows to drop as well (see cross_shard_duplicates). Implies
+    drop_duplicates. Defaults to None.
+    :return: The number of rows written for each file.
+    """
+    _check_out_paths(data_paths, out_paths)
+    exclude = exclude if exclude is not None else [None] * len(data_paths)
+    return Parallel(n_jobs=n_jobs)(
+        delayed(_transform_shard)(preprocessor, path, out_path, chunk_size, clean, drop_duplicates, shard_exclude)
+        for path, out_path, shard_exclude in zip(data_paths, out_paths, exclude)
+    )
+
+
+def process_csv_sharded(train_data_paths: list[str], predict_data_paths: list[str], train_out_paths: list[str],
+                        predict_out_paths: list[str], n_jobs: int = -1, chunk_size: int = 100_000,
+                        sketch_size: int = 4096) -> Preprocessor:
+    """
+    The sharded counterpart of process_csv_streaming: the Preprocessor is fitted on every training shard (see
+    fit_sharded), then each worker writes its processed training shard, without the rows an earlier shard holds, and
+    the test files are transformed with the merged training statistics. Classes are not re-balanced.
+    :param train_data_paths: The paths to the training CSV files, one per shard.
+    :param predict_data_paths: The paths to the test CSV files.
+    :param train_out_paths: The path to write each processed training shard to.
+    :param predict_out_paths: The path to write each processed test file to.
+    :param n_jobs: The number of worker processes, as for joblib. Defaults to -1 (all CPUs).
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :return: The fitted Preprocessor.
+    """
+    _check_out_paths(train_data_paths + predict_data_paths, train_out_paths + predict_out_paths)
+    preprocessor, duplicates = _fit_sharded(train_data_paths, n_jobs, chunk_size, sketch_size)
+    transform_sharded(preprocessor, train_data_paths, train_out_paths, n_jobs, chunk_size, clean=True,
+                      drop_duplicates=True, exclude=duplicates)
+    transform_sharded(preprocessor, predict_data_paths, predict_out_paths, n_jobs, chunk_size)
+    return preprocessor
+
+
+def shard_out_paths(data_paths: list[str], out_dir: str) -> list[str]:
+    """
+    Names the output file of each shard after its path relative to the directory all the shards share, so shards with
+    the same file name in different site directories (siteA/train.csv, siteB/train.csv) do not overwrite each other.
+    :param data_paths: The paths to the shards' CSV files.
+    :param out_dir: The directory to write the output files to.
+    :return: The path of the output file of each shard, e.g. out_dir/siteA/train.csv.
+    """
+    paths = [os.path.abspath(path) for path in data_paths]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [os.path.join(out_dir, os.path.relpath(path, root)) for path in paths]
+
+
+def _check_out_paths(data_paths: list[str], out_paths: list[str]) -> None:
+    # Workers writing to the same file would interleave their rows without any error
+    if len(out_paths) != len(data_paths):
+        raise ValueError(f"Got {len(out_paths)} output paths for {len(data_paths)} input files.")
+    seen = {}
+    for data_path, out_path in zip(data_paths, out_paths):
+        out_path = os.path.abspath(out_path)
+        if out_path in seen:
+            raise ValueError(f"{data_path} and {seen[out_path]} would both be written to {out_path}.")
+        seen[out_path] = data_path
+
+
+def _fit_sharded(train_data_paths: list[str], n_jobs: int = -1, chunk_size: int = 100_000, sketch_size: int = 4096,
+                 whisker_width: float = 1.5, added_const: float = 0.001,
+                 exact_scaler: bool = True) -> tuple[Preprocessor, list[np.ndarray]]:
+    with Parallel(n_jobs=n_jobs) as parallel:
+        results = parallel(delayed(shard_statistics)(path, chunk_size, sketch_size) for path in train_data_paths)
+        duplicates = cross_shard_duplicates([hashes for _, hashes in results])
+        # Shards holding rows of an earlier shard summarize their rows again without them (rare for disjoint sites)
+        redo = [i for i, shard_duplicates in enumerate(duplicates) if len(shard_duplicates)]
+        redone = parallel(delayed(shard_statistics)(train_data_paths[i], chunk_size, sketch_size, duplicates[i])
+                          for i in redo)
+        shard_stats = [stats for stats, _ in results]
+        for i, (stats, _) in zip(redo, redone):
+            shard_stats[i] = stats
+
+        stats = TrainingStatistics(sketch_size)
+        for other in shard_stats:
+            stats.merge(other)
+        preprocessor = stats.to_preprocessor(whisker_width, added_const)
+
+        if exact_scaler:
+            moments = RunningMoments(len(FEATURE_COLS))
+            for other in parallel(delayed(shard_moments)(preprocessor, path, chunk_size, shard_duplicates)
+                                  for path, shard_duplicates in zip(train_data_paths, duplicates)):
+                moments.merge(other)
+            preprocessor.scaler_ = _fitted_scaler(moments.mean, moments.std, stats.count)
+    return preprocessor, duplicates
+
+
+def _transform_shard(preprocessor: Preprocessor, path: str, out_path: str, chunk_size: int, clean: bool,
+                     drop_duplicates: bool, exclude: np.ndarray | None) -> int:
+    seen = _seen(exclude) if exclude is not None else None
+    return transform_streaming(preprocessor, path, out_path, chunk_size, clean, drop_duplicates, seen)
+
+
+def _seen(exclude: np.ndarray | None) -> set[int]:
+    return set(exclude.tolist()) if exclude is not None else set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded multi-process preprocessing of site-partitioned data.")
+    parser.add_argument("--train", nargs="+", required=True, help="The training CSV files, one per shard.")
+    parser.add_argument("--predict", nargs="*", default=[], help="The test CSV files.")
+    parser.add_argument("--out-dir", required=True,
+                        help="Processed files are written to its train/ and predict/ subdirectories (see "
+                             "shard_out_paths), and the fitted Preprocessor to preprocessor.joblib.")
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--sketch-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    out_paths = {part: shard_out_paths(paths, os.path.join(args.out_dir, part))
+                 for part, paths in (("train", args.train), ("predict", args.predict))}
+    for path in out_paths["train"] + out_paths["predict"]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    process_csv_sharded(args.train, args.predict, out_paths["train"], out_paths["predict"], args.n_jobs,
+                        args.chunk_size, args.sketch_size).save(os.path.join(args.out_dir, "preprocessor.joblib"))
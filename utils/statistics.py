@@ -0,0 +1,164 @@
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Mergeable per-column count, mean and variance (Welford's algorithm, with Chan's formula to combine batches).
+    """
+
+    def __init__(self, n_columns: int):
+        """
+        :param n_columns: The number of columns to track.
+        """
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.mean = np.zeros(n_columns, dtype=np.float64)
+        self.m2 = np.zeros(n_columns, dtype=np.float64)
+
+    def update(self, values: np.ndarray) -> "RunningMoments":
+        """
+        Adds a batch of rows. NaN values are ignored.
+        :param values: A 2D array, one column per tracked column.
+        :return: The updated RunningMoments itself.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        batch = RunningMoments(values.shape[1])
+        batch.count = (~np.isnan(values)).sum(axis=0)
+        with np.errstate(invalid="ignore"):
+            batch.mean = np.where(batch.count > 0, np.nanmean(values, axis=0), 0)
+            batch.m2 = np.nansum((values - batch.mean) ** 2, axis=0)
+        return self.merge(batch)
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        """
+        Combines the moments of another RunningMoments (in-place).
+        :param other: The moments to merge into this one.
+        :return: The updated RunningMoments itself.
+        """
+        count = self.count + other.count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = other.mean - self.mean
+            self.mean = np.where(count > 0, self.mean + delta * other.count / count, 0)
+            self.m2 = self.m2 + other.m2 + np.where(count > 0, delta ** 2 * self.count * other.count / count, 0)
+        self.count = count
+        return self
+
+    @property
+    def variance(self) -> np.ndarray:
+        """
+        The population variance of each column (the same definition StandardScaler uses).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.m2 / self.count, np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        """
+        The population standard deviation of each column.
+        """
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """
+    A mergeable quantile sketch of a single column, in the style of KLL. Values are kept exactly until the sketch holds
+    more than `size` items; after that, full levels are sorted and every other item is promoted to the next level with
+    twice the weight. Memory stays O(size * log(n / size)) and the rank error is roughly O(1 / size).
+    """
+
+    def __init__(self, size: int = 4096, random_state: int = 0):
+        """
+        :param size: The number of items a level can hold before it is compacted. Defaults to 4096.
+        :param random_state: Seed for the compaction offsets, so results are reproducible. Defaults to 0.
+        """
+        self.size = size
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(random_state)
+
+    def update(self, values: np.ndarray) -> "QuantileSketch":
+        """
+        Adds a batch of values. NaN values are ignored.
+        :param values: A 1D array of values.
+        :return: The updated QuantileSketch itself.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        self._compact()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Combines another sketch into this one (in-place).
+        :param other: The sketch to merge into this one.
+        :return: The updated QuantileSketch itself.
+        """
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+            self.levels[height] = np.concatenate([self.levels[height], items])
+        self._compact()
+        return self
+
+    @property
+    def count(self) -> int:
+        """
+        The (weighted) number of values added to the sketch.
+        """
+        return sum(len(items) << height for height, items in enumerate(self.levels))
+
+    @property
+    def exact(self) -> bool:
+        """
+        Whether the sketch still holds every value it was given.
+        """
+        return len(self.levels) == 1
+
+    def weighted_items(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The items held by the sketch, sorted, and their weights.
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 1 << height, dtype=np.int64)
+                                  for height, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], weights[order]
+
+    def quantile(self, q: float | np.ndarray) -> float | np.ndarray:
+        """
+        Estimates quantiles with linear interpolation (exactly np.quantile while the sketch is exact).
+        :param q: The quantile(s) to estimate, between 0 and 1.
+        :return: The estimated quantile(s).
+        """
+        return weighted_quantile(*self.weighted_items(), q)
+
+    def _compact(self) -> None:
+        height = 0
+        while height < len(self.levels):
+            if len(self.levels[height]) > self.size:
+                items = np.sort(self.levels[height])
+                if len(items) % 2:  # Keep the odd one out at this level
+                    self.levels[height], items = items[-1:], items[:-1]
+                else:
+                    self.levels[height] = np.empty(0, dtype=np.float64)
+                if height + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, dtype=np.float64))
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[height + 1] = np.concatenate([self.levels[height + 1], promoted])
+            height += 1
+
+
+def weighted_quantile(items: np.ndarray, weights: np.ndarray, q: float | np.ndarray) -> float | np.ndarray:
+    """
+    Quantiles of sorted items with integer weights, computed as if each item were repeated `weight` times and passed to
+    np.quantile (linear interpolation). The repeated array is never materialized.
+    :param items: The sorted items.
+    :param weights: The integer weight of each item.
+    :param q: The quantile(s) to compute, between 0 and 1.
+    :return: The quantile(s).
+    """
+    cum_weights = np.cumsum(weights)
+    position = (cum_weights[-1] - 1) * np.asarray(q, dtype=np.float64)
+    below = np.floor(position)
+    # The item at (0-based) rank r in the repeated array is the first one whose cumulative weight exceeds r
+    lower = items[np.searchsorted(cum_weights, below, side="right")]
+    upper = items[np.minimum(np.searchsorted(cum_weights, below + 1, side="right"), len(items) - 1)]
+    return lower + (upper - lower) * (position - below)
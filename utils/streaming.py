@@ -0,0 +1,220 @@
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+import pandas as pd
+
+from utils.processing import FEATURE_COLS, ZERO_INVALID_COLS, Preprocessor, _prepare
+from utils.statistics import QuantileSketch, weighted_quantile
+
+if TYPE_CHECKING:
+    from sklearn.preprocessing import StandardScaler
+
+# Compact dtypes for the Paitients_Files schema. ID and Insurance are never needed by the pipeline, so they are not read.
+SOURCE_DTYPES = {
+    'PRG': np.int16,
+    'PL': np.int16,
+    'PR': np.int16,
+    'SK': np.int16,
+    'TS': np.int16,
+    'M11': np.float32,
+    'BD2': np.float32,
+    'Age': np.int16,
+    'Sepssis': pd.CategoricalDtype(["Negative", "Positive"]),
+}
+
+
+class TrainingStatistics:
+    """
+    Accumulates, chunk by chunk, everything the Preprocessor needs to be fitted: the per-column sums and zero counts for
+    the zero-replacement means, and a quantile sketch of each column for the IQR bounds. Statistics of different chunks
+    (or different files) can be merged.
+    """
+
+    def __init__(self, sketch_size: int = 4096):
+        """
+        :param sketch_size: The size of the quantile sketches. Data smaller than this is summarized exactly.
+        Defaults to 4096.
+        """
+        self.count = 0
+        self.sums = np.zeros(len(FEATURE_COLS), dtype=np.float64)
+        self.zero_counts = np.zeros(len(FEATURE_COLS), dtype=np.int64)
+        # Zeros of ZERO_INVALID_COLS are replaced by the mean later on, so they are counted rather than sketched
+        self.sketches = [QuantileSketch(sketch_size) for _ in FEATURE_COLS]
+
+    def update(self, df: pd.DataFrame) -> "TrainingStatistics":
+        """
+        Adds a chunk of (prepared and de-duplicated) training rows.
+        :param df: The chunk, with at least the feature columns.
+        :return: The updated TrainingStatistics itself.
+        """
+        values = df[FEATURE_COLS].to_numpy(dtype=np.float64)
+        self.count += len(values)
+        self.sums += values.sum(axis=0)
+        self.zero_counts += (values == 0).sum(axis=0)
+        for i, col in enumerate(FEATURE_COLS):
+            column = values[:, i]
+            self.sketches[i].update(column[column != 0] if col in ZERO_INVALID_COLS else column)
+        return self
+
+    def merge(self, other: "TrainingStatistics") -> "TrainingStatistics":
+        """
+        Combines the statistics of another TrainingStatistics (in-place).
+        :param other: The statistics to merge into this one.
+        :return: The updated TrainingStatistics itself.
+        """
+        self.count += other.count
+        self.sums += other.sums
+        self.zero_counts += other.zero_counts
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    def to_preprocessor(self, whisker_width: float = 1.5, added_const: float = 0.001) -> Preprocessor:
+        """
+        Derives a fitted Preprocessor from the statistics. While the sketches are exact, the result matches
+        Preprocessor.fit on the same data (up to floating point rounding); beyond that, the bounds and the scaler are
+        estimated within the sketch error.
+        :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+        :param added_const: The constant added to non-zero values before taking their log. Defaults to 0.001.
+        :return: The fitted Preprocessor.
+        """
+        preprocessor = Preprocessor(whisker_width=whisker_width, added_const=added_const)
+        means = self.sums / self.count
+        preprocessor.zero_means_ = {col: means[i] for i, col in enumerate(FEATURE_COLS) if col in ZERO_INVALID_COLS}
+        preprocessor.imputer_ = None
+
+        n_cols = len(FEATURE_COLS)
+        impute_bounds, impute_values, cap_bounds = np.empty((2, n_cols)), np.empty(n_cols), np.empty((2, n_cols))
+        log_moments = np.empty((2, n_cols))
+        for i, col in enumerate(FEATURE_COLS):
+            items, weights = self.sketches[i].weighted_items()
+            if col in ZERO_INVALID_COLS and self.zero_counts[i]:
+                items, weights = _add_point_mass(items, weights, means[i], self.zero_counts[i])
+
+            # Impute outliers with the inlier mean, then cap remaining outliers (see treat_outliers_iqr)
+            impute_bounds[:, i] = _bounds(items, weights, whisker_width)
+            inliers = (items >= impute_bounds[0, i]) & (items <= impute_bounds[1, i])
+            impute_values[i] = np.average(items[inliers], weights=weights[inliers])
+            items, weights = _add_point_mass(items[inliers], weights[inliers], impute_values[i],
+                                             weights[~inliers].sum())
+            cap_bounds[:, i] = _bounds(items, weights, whisker_width)
+
+            logs = preprocessor._log(np.clip(items, *cap_bounds[:, i]))
+            log_moments[0, i] = np.average(logs, weights=weights)
+            log_moments[1, i] = np.sqrt(np.average((logs - log_moments[0, i]) ** 2, weights=weights))
+
+        preprocessor.impute_bounds_, preprocessor.impute_values_, preprocessor.cap_bounds_ = (
+            impute_bounds, impute_values, cap_bounds
+        )
+        preprocessor.scaler_ = _fitted_scaler(log_moments[0], log_moments[1], self.count)
+        return preprocessor
+
+
+def read_csv_chunks(path: str, chunk_size: int = 100_000, drop_duplicates: bool = False,
+                    seen: set[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a Paitients_Files CSV in fixed-size chunks, using the compact SOURCE_DTYPES, and prepares each chunk the way
+    the pipeline expects (unused columns dropped, target renamed and mapped).
+    :param path: The path to the CSV file.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param drop_duplicates: Drop rows that already appeared in this file. Duplicates are tracked by row hash, which costs
+    memory per distinct row. Defaults to False.
+    :param seen: The row hashes to drop, updated with the hashes of the rows kept, so duplicates can be dropped across
+    files (e.g. rows already read from another shard). Implies drop_duplicates. Defaults to None.
+    :return: An iterator over the prepared chunks.
+    """
+    columns = pd.read_csv(path, nrows=0).columns
+    usecols = [col for col in columns if col in SOURCE_DTYPES]
+    dtypes = {col: SOURCE_DTYPES[col] for col in usecols}
+    drop_duplicates = drop_duplicates or seen is not None
+    seen = seen if seen is not None else set()
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunk_size):
+        chunk = _prepare(chunk)
+        if drop_duplicates:
+            hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            keep = ~pd.Series(hashes).duplicated().to_numpy()
+            keep &= np.array([h not in seen for h in hashes.tolist()], dtype=bool)
+            seen.update(hashes[keep].tolist())
+            chunk = chunk[keep]
+        yield chunk
+
+
+def fit_streaming(train_data_path: str, chunk_size: int = 100_000, sketch_size: int = 4096,
+                  whisker_width: float = 1.5, added_const: float = 0.001) -> Preprocessor:
+    """
+    Fits a Preprocessor on a training CSV in a single streaming pass, with bounded memory.
+    :param train_data_path: The path to the training dataset file.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
+    :param added_const: The constant added to non-zero values before taking their log. Defaults to 0.001.
+    :return: The fitted Preprocessor.
+    """
+    stats = TrainingStatistics(sketch_size)
+    for chunk in read_csv_chunks(train_data_path, chunk_size, drop_duplicates=True):
+        stats.update(chunk)
+    return stats.to_preprocessor(whisker_width, added_const)
+
+
+def transform_streaming(preprocessor: Preprocessor, data_path: str, out_path: str, chunk_size: int = 100_000,
+                        clean: bool = True, drop_duplicates: bool = False, seen: set[int] = None) -> int:
+    """
+    Transforms a CSV chunk by chunk with a fitted Preprocessor, appending each chunk to the output CSV.
+    :param preprocessor: The fitted Preprocessor.
+    :param data_path: The path to the dataset file to transform.
+    :param out_path: The path of the CSV file to write.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param clean: Also replace zeros and treat outliers (see Preprocessor.transform). Defaults to True.
+    :param drop_duplicates: Drop duplicated rows, like the training data cleaning does. Defaults to False.
+    :param seen: The row hashes to drop as well (see read_csv_chunks). Implies drop_duplicates. Defaults to None.
+    :return: The number of rows written.
+    """
+    n_rows = 0
+    for chunk in read_csv_chunks(data_path, chunk_size, drop_duplicates, seen):
+        preprocessor.transform(chunk, clean).to_csv(out_path, mode="w" if n_rows == 0 else "a",
+                                                    header=n_rows == 0, index=False)
+        n_rows += len(chunk)
+    return n_rows
+
+
+def process_csv_streaming(train_data_path: str, predict_data_path: str, train_out_path: str, predict_out_path: str,
+                          chunk_size: int = 100_000, sketch_size: int = 4096) -> Preprocessor:
+    """
+    The streaming counterpart of DataCSV, for extracts too large to hold in memory: the first pass over the training
+    file fits the Preprocessor, the second pass writes the processed training data and the test data is then transformed
+    with the training statistics. Peak memory depends on chunk_size and sketch_size, not on the size of the files
+    (except for the row hashes used to drop duplicated training rows). Classes are not re-balanced.
+    :param train_data_path: The path to the training dataset file.
+    :param predict_data_path: The path to the test dataset file.
+    :param train_out_path: The path to write the processed training data to.
+    :param predict_out_path: The path to write the processed test data to.
+    :param chunk_size: The number of rows per chunk. Defaults to 100,000.
+    :param sketch_size: The size of the quantile sketches. Defaults to 4096.
+    :return: The fitted Preprocessor.
+    """
+    preprocessor = fit_streaming(train_data_path, chunk_size, sketch_size)
+    transform_streaming(preprocessor, train_data_path, train_out_path, chunk_size, clean=True, drop_duplicates=True)
+    transform_streaming(preprocessor, predict_data_path, predict_out_path, chunk_size)
+    return preprocessor
+
+
+def _add_point_mass(items: np.ndarray, weights: np.ndarray, value: float, weight: int) -> tuple[np.ndarray, np.ndarray]:
+    position = np.searchsorted(items, value, side="right")
+    return np.insert(items, position, value), np.insert(weights, position, weight)
+
+
+def _bounds(items: np.ndarray, weights: np.ndarray, whisker_width: float) -> np.ndarray:
+    q1, q3 = weighted_quantile(items, weights, [0.25, 0.75])
+    iqr = q3 - q1
+    return np.array([q1 - whisker_width * iqr, q3 + whisker_width * iqr])
+
+
+def _fitted_scaler(mean: np.ndarray, std: np.ndarray, n_samples: int) -> "StandardScaler":
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    scaler.mean_, scaler.var_, scaler.n_samples_seen_ = mean, std ** 2, n_samples
+    scaler.scale_ = np.where(std == 0, 1.0, std)
+    scaler.n_features_in_ = len(mean)
+    scaler.feature_names_in_ = np.array(FEATURE_COLS, dtype=object)
+    return scaler
@@ -0,0 +1,180 @@
+import hashlib
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba
+import numpy as np
+import pandas as pd
+
+
+class DistributionSummary:
+    """
+    The histogram counts and the kernel density estimate of one column (or of the rows of one class of a column), which
+    is all the distribution plots draw. Its size does not depend on the number of rows summarized.
+    """
+
+    def __init__(self, n: int, edges: np.ndarray | None, counts: np.ndarray | None, support: np.ndarray | None,
+                 density: np.ndarray | None):
+        """
+        :param n: The number of (non-missing) values summarized.
+        :param edges: The histogram bin edges, or None if no histogram was computed.
+        :param counts: The histogram counts, or None if no histogram was computed.
+        :param support: The grid the density is estimated on, or None if no KDE was computed (or the values are
+        constant).
+        :param density: The density estimated on support, or None.
+        """
+        self.n = n
+        self.edges = edges
+        self.counts = counts
+        self.support = support
+        self.density = density
+
+    def hist(self, ax: plt.Axes, **kwargs) -> None:
+        """
+        Draws the histogram, like ax.hist would on the raw values.
+        :param ax: The Axes to draw on.
+        :param kwargs: Passed to ax.hist (e.g. density, color, alpha, label).
+        :return: None
+        """
+        ax.hist((self.edges[:-1] + self.edges[1:]) / 2, bins=self.edges, weights=self.counts, **kwargs)
+
+    def kdeplot(self, ax: plt.Axes, fill: bool = False, color: str = None, alpha: float = None, label: str = None) -> None:
+        """
+        Draws the density curve, like seaborn.kdeplot would on the raw values.
+        :param ax: The Axes to draw on.
+        :param fill: Fill the area under the curve. Defaults to False.
+        :param color: The color of the curve. Defaults to None (next color of the cycle).
+        :param alpha: The opacity of the curve. Defaults to None (opaque).
+        :param label: The legend label. Defaults to None.
+        :return: None
+        """
+        if self.density is None:
+            return
+        if fill:
+            artist = ax.fill_between(self.support, self.density, edgecolor=color, label=label,
+                                     facecolor=to_rgba(color, 0.25) if color is not None else None)
+        else:
+            artist, = ax.plot(self.support, self.density, color=color, alpha=alpha, label=label)
+        artist.sticky_edges.y[:] = (0, np.inf)  # The density axis starts at 0, as in seaborn
+
+
+_cache = OrderedDict()
+_CACHE_SIZE = 512
+
+
+def summarize(df: pd.DataFrame, cols: list[str], bins: int = None, kde: bool = True, by: str = None,
+              gridsize: int = 200, cut: float = 3, bw_adjust: float = 1) -> dict[tuple, DistributionSummary]:
+    """
+    Summarizes columns for the distribution plots: histogram counts, and a Gaussian KDE binned on a fine grid and
+    convolved with the kernel by FFT, so it costs O(n + grid log grid) instead of O(n * grid). The bandwidth (Scott's
+    rule), support and grid match seaborn.kdeplot. Summaries are cached by the hash of the values they summarize, so
+    the same column is only summarized once across figures.
+    :param df: The DataFrame.
+    :param cols: The columns to summarize.
+    :param bins: The number of equal width histogram bins. Defaults to None (no histogram).
+    :param kde: Whether to estimate the density. Defaults to True.
+    :param by: Summarize the rows of each class of this column separately. Defaults to None (all rows together).
+    :param gridsize: The number of points the density is estimated on. Defaults to 200.
+    :param cut: How far, in bandwidths, the support extends past the extreme values. Defaults to 3.
+    :param bw_adjust: Factor the bandwidth is multiplied with. Defaults to 1.
+    :return: The summaries, keyed by (column, class); the class is None if by is None.
+    """
+    groups = [(None, df)] if by is None else [(cls, df.loc[df[by] == cls]) for cls in sorted(df[by].dropna().unique())]
+    summaries = {}
+    for cls, group in groups:
+        values = np.asfortranarray(group[cols].to_numpy(dtype=np.float64))  # Contiguous columns
+        keys = [
+            (hashlib.sha1(values[:, j]).hexdigest(), bins, kde, gridsize, cut, bw_adjust)
+            for j in range(len(cols))
+        ]
+        missing = [j for j, key in enumerate(keys) if key not in _cache]
+        if missing:
+            # One vectorized pass over the uncached columns for the statistics every summary needs
+            subset = values[:, missing]
+            counts = len(subset) - np.count_nonzero(np.isnan(subset), axis=0)
+            lows = np.full(len(missing), np.nan)
+            highs = np.full(len(missing), np.nan)
+            stds = np.full(len(missing), np.nan)
+            if len(subset) and (counts == len(subset)).all():
+                lows, highs = subset.min(axis=0), subset.max(axis=0)
+                if kde and len(subset) > 1:
+                    stds = subset.std(axis=0, ddof=1)
+            else:
+                valid = counts > 0
+                lows[valid] = np.nanmin(subset[:, valid], axis=0)
+                highs[valid] = np.nanmax(subset[:, valid], axis=0)
+                if kde:
+                    several = counts > 1
+                    stds[several] = np.nanstd(subset[:, several], axis=0, ddof=1)
+            for k, j in enumerate(missing):
+                _cache[keys[j]] = _summarize(subset[:, k], counts[k], lows[k], highs[k], stds[k], bins, kde,
+                                             gridsize, cut, bw_adjust)
+                while len(_cache) > _CACHE_SIZE:
+                    _cache.popitem(last=False)
+        for col, key in zip(cols, keys):
+            _cache.move_to_end(key)
+            summaries[col, cls] = _cache[key]
+    return summaries
+
+
+def clear_cache() -> None:
+    """
+    Empties the summary cache.
+    :return: None
+    """
+    _cache.clear()
+
+
+def binned_kde(values: np.ndarray, low: float, high: float, std: float, gridsize: int = 200, cut: float = 3,
+               bw_adjust: float = 1) -> tuple[np.ndarray, np.ndarray] | tuple[None, None]:
+    """
+    Estimates a Gaussian KDE by linear binning on a fine grid and an FFT convolution with the kernel.
+    :param values: The values, without missing values.
+    :param low: The smallest value.
+    :param high: The largest value.
+    :param std: The standard deviation (ddof=1) of the values.
+    :param gridsize: The number of points the density is estimated on. Defaults to 200.
+    :param cut: How far, in bandwidths, the support extends past the extreme values. Defaults to 3.
+    :param bw_adjust: Factor the bandwidth is multiplied with. Defaults to 1.
+    :return: The support and the density, or (None, None) if the values are too few or constant.
+    """
+    n = len(values)
+    if n < 2 or not std > 0:
+        return None, None
+    bandwidth = std * n ** -0.2 * bw_adjust  # Scott's rule, as scipy.stats.gaussian_kde
+    start, stop = low - cut * bandwidth, high + cut * bandwidth
+    support = np.linspace(start, stop, gridsize)
+
+    # At least 8 fine grid points per bandwidth keeps the binning error well below what a plot can show
+    m = int(np.clip(8 * (stop - start) / bandwidth, 2 ** 10, 2 ** 16))
+    delta = (stop - start) / (m - 1)
+    position = values - start
+    position /= delta
+    left = position.astype(np.intp)
+    np.minimum(left, m - 2, out=left)
+    right_weight = position
+    right_weight -= left
+    # Each value is split between its two neighbouring grid points, in proportion to how close it is to each
+    right = np.bincount(left, right_weight, minlength=m)
+    weights = np.bincount(left, minlength=m) - right
+    weights[1:] += right[:-1]
+
+    kernel = np.exp(-0.5 * (np.arange(-(m - 1), m) * delta / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    size = 1 << int(np.ceil(np.log2(3 * m - 2)))
+    convolved = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)[m - 1:2 * m - 1]
+    density = np.interp(support, np.linspace(start, stop, m), np.maximum(convolved, 0)) / n
+    return support, density
+
+
+def _summarize(values: np.ndarray, n: int, low: float, high: float, std: float, bins: int | None, kde: bool,
+               gridsize: int, cut: float, bw_adjust: float) -> DistributionSummary:
+    edges = counts = support = density = None
+    if n == 0:
+        return DistributionSummary(0, edges, counts, support, density)
+    if bins is not None:
+        counts, edges = np.histogram(values, bins=bins, range=(low, high))
+    if kde:
+        if n < len(values):
+            values = values[~np.isnan(values)]
+        support, density = binned_kde(values, low, high, std, gridsize, cut, bw_adjust)
+    return DistributionSummary(int(n), edges, counts, support, density)
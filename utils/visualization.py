@@ -6,6 +6,33 @@ from matplotlib import ticker
 from sklearn.metrics import confusion_matrix, classification_report, f1_score
 from sklearn.model_selection import GridSearchCV
 
+from utils.evaluation import BootstrapResult
+from utils.quality import profile_quality
+from utils.summaries import summarize
+
+
+_headless = False
+
+
+def set_headless(headless: bool = True) -> None:
+    """
+    Switches every plotting function in this module between interactive use (the default) and headless rendering,
+    where plt.show() is skipped and each figure is closed once it is saved, to free its memory.
+    :param headless: Whether to render headless. Defaults to True.
+    :return: None
+    """
+    global _headless
+    _headless = headless
+
+
+def _show_and_save(fig: plt.Figure, save_path: str, save_dpi: int) -> None:
+    if not _headless:
+        plt.show()
+    if save_path is not None:
+        fig.savefig(save_path, dpi=save_dpi)
+    if _headless:
+        plt.close(fig)
+
 
 def header(width: int, title: str) -> str:
     """
@@ -37,36 +64,26 @@ def show_aggregate_distribution(train: pd.DataFrame, test: pd.DataFrame, save_pa
     fig, axes = plt.subplots(nrows=3, ncols=3, figsize=(15, 15), constrained_layout=True)
     axes = axes.ravel()
 
+    # The histograms and KDEs are drawn from summaries, so the cost of the figure barely depends on the number of rows
+    feature_cols = [col for col in train.columns if col != "Sepsis"]
+    train_summaries = summarize(train, feature_cols, bins=min(train.shape[0] // 10, 18))
+    test_summaries = summarize(test, feature_cols, bins=min(test.shape[0] // 10, 18))
+
     for i, col in enumerate(train.columns):
         if col != "Sepsis":
-            axes[i].hist(
-                train[col],
-                bins=min(train.shape[0] // 10, 18),
-                color="royalblue",
-                density=True,
-                alpha=0.5,
-                label="Train Data"
-            )
-            sns.kdeplot(train[col], ax=axes[i], color="blue", alpha=0.8, label="Train Data KDE")
-
-            axes[i].hist(
-                test[col],
-                bins=min(test.shape[0] // 10, 18),
-                color="crimson",
-                density=True,
-                alpha=0.5,
-                label="Test Data"
-            )
-            sns.kdeplot(test[col], ax=axes[i], color="red", alpha=0.8, label="Test Data KDE")
+            train_summary, test_summary = train_summaries[col, None], test_summaries[col, None]
+            train_summary.hist(axes[i], color="royalblue", density=True, alpha=0.5, label="Train Data")
+            train_summary.kdeplot(axes[i], color="blue", alpha=0.8, label="Train Data KDE")
+
+            test_summary.hist(axes[i], color="crimson", density=True, alpha=0.5, label="Test Data")
+            test_summary.kdeplot(axes[i], color="red", alpha=0.8, label="Test Data KDE")
 
             axes[i].set_ylabel("Probability density", fontsize=10)
             axes[i].set_xlabel("Value", fontsize=10)
-            axes[i].set_xlim(left=min(test[col].min(), test[col].min()),
-                             right=max(train[col].max(), train[col].max()))
+            axes[i].set_xlim(left=test_summary.edges[0], right=train_summary.edges[-1])
         else:
-            axes[i].hist(
-                train[col],
-                bins=2,
+            summarize(train, [col], bins=2, kde=False)[col, None].hist(
+                axes[i],
                 color="sandybrown",
                 alpha=0.8,
                 label="Train Data Target"
@@ -77,10 +94,7 @@ def show_aggregate_distribution(train: pd.DataFrame, test: pd.DataFrame, save_pa
         axes[i].set_title(col, fontsize=14, fontweight="bold")
         axes[i].legend()
 
-    plt.show()
-
-    if save_path is not None:
-        fig.savefig(save_path, dpi=save_dpi)
+    _show_and_save(fig, save_path, save_dpi)
 
 
 def show_distribution(col: str, train: pd.DataFrame, test: pd.DataFrame, save_path: str = None,
@@ -123,7 +137,7 @@ def show_distribution(col: str, train: pd.DataFrame, test: pd.DataFrame, save_pa
 
     # Graph 2: Box plot
     axes[1].boxplot([test[col], train[col]], vert=False, labels=["Test Data", "Train Data"], widths=0.5)
-    plt.show()
+    _show_and_save(fig, save_path, save_dpi)
 
     # Print out numerical distribution statistics
     df_prg_summary = pd.concat(
@@ -138,9 +152,6 @@ def show_distribution(col: str, train: pd.DataFrame, test: pd.DataFrame, save_pa
     print(f"\nNumber of outliers in train data: {count_outliers_iqr(col, train)}")
     print(f"Number of outliers in test data: {count_outliers_iqr(col, test)}")
 
-    if save_path is not None:
-        fig.savefig(f"../images/EDA_Distribution_{col}.png", dpi=save_dpi)
-
 
 def show_distribution_corr(feature_col: str, target_col: str, df: pd.DataFrame, title: str = None,
                            ticker_multiple_locator: int = 5, save_path: str = None, save_dpi: int = 300) -> None:
@@ -159,8 +170,9 @@ def show_distribution_corr(feature_col: str, target_col: str, df: pd.DataFrame,
     fig, axes = plt.subplots(nrows=2, ncols=1, figsize=(12, 5), constrained_layout=True, sharex="col",
                              gridspec_kw={"height_ratios": [3, 1]})
 
-    sns.kdeplot(df.loc[df[target_col] == 0, feature_col], fill=True, color="dodgerblue", label="Negative", ax=axes[0])
-    sns.kdeplot(df.loc[df[target_col] == 1, feature_col], fill=True, color="red", label="Positive", ax=axes[0])
+    summaries = summarize(df, [feature_col], by=target_col)
+    summaries[feature_col, 0].kdeplot(axes[0], fill=True, color="dodgerblue", label="Negative")
+    summaries[feature_col, 1].kdeplot(axes[0], fill=True, color="red", label="Positive")
     axes[0].legend(title="Sepsis", loc="upper right", labels=["Negative", "Positive"])
     axes[0].set_ylabel("Probability density", fontsize=12)
     axes[0].xaxis.set_major_locator(
@@ -180,9 +192,7 @@ def show_distribution_corr(feature_col: str, target_col: str, df: pd.DataFrame,
     )
     axes[1].set_xlabel(feature_col, fontsize=12)
 
-    plt.show()
-    if save_path is not None:
-        fig.savefig(save_path, dpi=save_dpi)
+    _show_and_save(fig, save_path, save_dpi)
 
 
 def show_boxplots(train: pd.DataFrame, test: pd.DataFrame, save_path: str = None, save_dpi: int = 300) -> None:
@@ -202,15 +212,17 @@ def show_boxplots(train: pd.DataFrame, test: pd.DataFrame, save_path: str = None
     axes[0].set_title("Train Data")
     axes[1].set_title("Test Data")
 
-    plt.show()
-    if save_path is not None:
-        fig.savefig(save_path, dpi=save_dpi)
+    _show_and_save(fig, save_path, save_dpi)
 
 
 def show_train_val_confusion_matrix(true_train_y: np.ndarray, train_pred_y: np.ndarray,
                                     true_val_y: np.ndarray, val_pred_y: np.ndarray,
                                     title: str = None,
-                                    save_path: str = None, save_dpi: int = 300) -> None:
+                                    save_path: str = None, save_dpi: int = 300,
+                                    train_sample_weight: np.ndarray = None,
+                                    val_sample_weight: np.ndarray = None,
+                                    train_bootstrap: BootstrapResult = None,
+                                    val_bootstrap: BootstrapResult = None) -> None:
     """
     Plots confusion matrices for true and predicted labels for training and validation sets. Also prints the
     classification report for both training and validation sets, which includes metrics like precision, recall,
@@ -222,11 +234,18 @@ def show_train_val_confusion_matrix(true_train_y: np.ndarray, train_pred_y: np.n
     :param title: The title for this plot (only display if provided). Defaults to None (not shown).
     :param save_path: The location for the plot produced by this function to be saved at. Defaults to None (no saving).
     :param save_dpi: The quality of the saved plot. Only takes effect if save_path is not None.
+    :param train_sample_weight: Train set sample weights (such as DataCSV.sample_weight), which weight the confusion
+    matrix and the report. Defaults to None (unweighted).
+    :param val_sample_weight: Validation set sample weights. Defaults to None (unweighted).
+    :param train_bootstrap: Train set bootstrap F1 and ROC-AUC (see utils.evaluation.bootstrap_metrics), printed with
+    their 95% confidence intervals below the report. Defaults to None (not printed).
+    :param val_bootstrap: Validation set bootstrap F1 and ROC-AUC. Defaults to None (not printed).
     :return: None
     """
     fig, axis = plt.subplots(nrows=1, ncols=2, figsize=(8, 3))
 
-    sns.heatmap(confusion_matrix(true_train_y, train_pred_y), annot=True, cmap="Blues", fmt="g", ax=axis[0])
+    sns.heatmap(confusion_matrix(true_train_y, train_pred_y, sample_weight=train_sample_weight),
+                annot=True, cmap="Blues", fmt="g", ax=axis[0])
     axis[0].set_xlabel("Predicted Values")
     axis[0].set_ylabel("True Values")
     axis[0].set_title("Training")
@@ -236,7 +255,8 @@ def show_train_val_confusion_matrix(true_train_y: np.ndarray, train_pred_y: np.n
     axis[0].set_yticks([0.5, 1.5])
     axis[0].set_yticklabels(["Negative", "Positive"])
 
-    sns.heatmap(confusion_matrix(true_val_y, val_pred_y), annot=True, cmap="Blues", fmt="g", ax=axis[1])
+    sns.heatmap(confusion_matrix(true_val_y, val_pred_y, sample_weight=val_sample_weight),
+                annot=True, cmap="Blues", fmt="g", ax=axis[1])
     axis[1].set_xlabel("Predicted Values")
     axis[1].set_ylabel("True Values")
     axis[1].set_title("Validation")
@@ -250,28 +270,39 @@ def show_train_val_confusion_matrix(true_train_y: np.ndarray, train_pred_y: np.n
     if title is not None:
         fig.suptitle(title, fontsize=16, fontweight="bold", y=1.2)
 
-    plt.show()
-    if save_path is not None:
-        fig.savefig(save_path, dpi=save_dpi)
-    print(f"{header(53, 'TRAINING PERFORMANCE')}\n{classification_report(true_train_y, train_pred_y)}")
-    print(f"{header(53, 'VALIDATION PERFORMANCE')}\n{classification_report(true_val_y, val_pred_y)}")
+    _show_and_save(fig, save_path, save_dpi)
+    train_report = classification_report(true_train_y, train_pred_y, sample_weight=train_sample_weight)
+    val_report = classification_report(true_val_y, val_pred_y, sample_weight=val_sample_weight)
+    if train_bootstrap is not None:
+        train_report += f"\n{train_bootstrap.summary().to_string(float_format='{:.4f}'.format)}\n"
+    if val_bootstrap is not None:
+        val_report += f"\n{val_bootstrap.summary().to_string(float_format='{:.4f}'.format)}\n"
+    print(f"{header(53, 'TRAINING PERFORMANCE')}\n{train_report}")
+    print(f"{header(53, 'VALIDATION PERFORMANCE')}\n{val_report}")
 
 
-def visualize_training(clf: GridSearchCV, title: str = None, save_path: str = None, save_dpi: int = 300, best=None) -> None:
+def visualize_training(clf: GridSearchCV, title: str = None, save_path: str = None, save_dpi: int = 300, best=None,
+                       intervals: dict[str, np.ndarray] = None) -> None:
     """
-    Visualize training process and results of a given model using F1 score as the metric.
-    :param clf: GridSearchCV object for hyperparameter tuning.
+    Visualize training process and results of a given model using F1 score as the metric. If clf was fitted with
+    sample weights (CachedGridSearchCV and SuccessiveHalvingSearchCV), its scores are weighted and labelled as such.
+    :param clf: GridSearchCV object for hyperparameter tuning (or a CachedGridSearchCV from utils.search).
     :param title: A string containing the title for the visualization (optional).
     :param save_path: The location for the plot produced by this function to be saved at. Defaults to None (no saving).
     :param save_dpi: The quality of the saved plot. Only takes effect if save_path is not None.
     :param best: Select a different line marking from clf.clf.best_index_. Defaults to None.
+    :param intervals: Confidence intervals of the test scores to shade around them: for "f1" and/or "roc_auc", a
+    (2, n_candidates) array of lower and upper bounds (see utils.evaluation.bootstrap_candidates). Defaults to None.
     :return: None
     """
+    weighted = " (sample weighted)" if getattr(clf, "sample_weight_", None) is not None else ""
     fig, axes = plt.subplots(nrows=2, ncols=1, figsize=(18, 10), sharex="all")
     sns.lineplot(
         x=range(len(clf.cv_results_["params"])), y=clf.cv_results_["mean_test_f1"],
         ax=axes[0], label="Test", linestyle="-", color="crimson"
     )
+    if intervals is not None and "f1" in intervals:
+        axes[0].fill_between(range(len(clf.cv_results_["params"])), *intervals["f1"], color="crimson", alpha=0.2)
     sns.lineplot(
         x=range(len(clf.cv_results_["params"])), y=clf.cv_results_["mean_train_f1"],
         ax=axes[0], label="Train", linestyle="--", color="royalblue"
@@ -282,7 +313,7 @@ def visualize_training(clf: GridSearchCV, title: str = None, save_path: str = No
         axes[0].axvline(x=best, color="y", label="Best")
     axes[0].legend()
     axes[0].set_xlabel("Hyperparameter")
-    axes[0].set_ylabel("F1 Score")
+    axes[0].set_ylabel(f"F1 Score{weighted}")
     if title is not None:
         axes[0].set_title(title)
 
@@ -290,6 +321,8 @@ def visualize_training(clf: GridSearchCV, title: str = None, save_path: str = No
         x=range(len(clf.cv_results_["params"])), y=clf.cv_results_["mean_test_roc_auc"],
         ax=axes[1], label="Test", linestyle="-", color="crimson"
     )
+    if intervals is not None and "roc_auc" in intervals:
+        axes[1].fill_between(range(len(clf.cv_results_["params"])), *intervals["roc_auc"], color="crimson", alpha=0.2)
     sns.lineplot(
         x=range(len(clf.cv_results_["params"])), y=clf.cv_results_["mean_train_roc_auc"],
         ax=axes[1], label="Train", linestyle="--", color="royalblue"
@@ -300,12 +333,10 @@ def visualize_training(clf: GridSearchCV, title: str = None, save_path: str = No
         axes[1].axvline(x=best, color="y", label="Best")
     axes[1].legend()
     axes[1].set_xlabel("Hyperparameter")
-    axes[1].set_ylabel("ROC-AUC")
+    axes[1].set_ylabel(f"ROC-AUC{weighted}")
 
     fig.tight_layout()
-    plt.show()
-    if save_path is not None:
-        fig.savefig(save_path, dpi=save_dpi)
+    _show_and_save(fig, save_path, save_dpi)
 
 
 def count_outliers_iqr(col: str, df: pd.DataFrame, whisker_width: float = 1.5) -> int:
@@ -316,10 +347,8 @@ def count_outliers_iqr(col: str, df: pd.DataFrame, whisker_width: float = 1.5) -
     :param whisker_width: The multiplier used to calculate the lower and upper bounds for outlier detection. Defaults to 1.5.
     :return: The number of outliers in the specified column.
     """
-    q1 = df[[col]].quantile(0.25)
-    q2 = df[[col]].quantile(0.75)
-    iqr = q2 - q1
-    return ((df[[col]] < (q1 - whisker_width * iqr)) | (df[[col]] > (q2 + whisker_width * iqr))).sum().sum()
+    return profile_quality(df, [col], whisker_width=whisker_width, duplicate_rows=False,
+                           duplicate_ids=False).outliers[0]
 
 
 def count_zero_vals(df: pd.DataFrame, cols: list[str]) -> str:
@@ -329,20 +358,12 @@ def count_zero_vals(df: pd.DataFrame, cols: list[str]) -> str:
     :param cols: Selected column to be processed
     :return: A string report
     """
-    head = f"{'':10}{'Count':>10}{'Percentage':>15}\n{'-' * 35}\n"
-    rows = ""
-    for col in cols:
-        zeroes_count = 0
-        if 0 in df[col].value_counts().index:
-            zeroes_count = df[col].value_counts()[0]
-        missing_percentage = zeroes_count / len(df) * 100
-        rows += f"{col:10}{zeroes_count:>10}{missing_percentage:>14.2f}%\n"
-    return head + rows
+    return profile_quality(df, cols, duplicate_rows=False, duplicate_ids=False).zero_report()
 
 
 def count_dup_entries(df: pd.DataFrame) -> int:
-    return df.duplicated().sum()
+    return profile_quality(df, [], id_col=None, duplicate_ids=False).duplicate_rows
 
 
 def count_dup_patients(df: pd.DataFrame) -> int:
-    return df.duplicated(subset='ID').sum()
+    return profile_quality(df, [], duplicate_rows=False).duplicate_ids